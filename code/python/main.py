@@ -1,3 +1,4 @@
+import atexit
 import os
 import sys
 from absl import app
@@ -5,9 +6,13 @@ from absl import flags
 from loguru import logger
 import asyncio
 
-from utils.builder import Builder
+from sensor_comm.utils.builder import Builder
+from sensor_comm.utils.profiling import PROFILER
 
 FLAGS = flags.FLAGS
+flags.DEFINE_enum('view_mode', 'TK', ['TK', 'HEADLESS', 'PROCESS'], 'See Builder.irtouch32.')
+flags.DEFINE_enum('fit_mode', 'INLINE', ['INLINE', 'THREAD', 'PROCESS'], 'See Builder.irtouch32.')
+flags.DEFINE_bool('profile', False, 'Time the processing stages and log a summary at exit.')
 
 
 def main(_):
@@ -17,8 +22,13 @@ def main(_):
     logger.configure(handlers=[{"sink": sys.stderr, "level": "DEBUG"}])
     logger.add(os.path.join('./data', "irtouch32_textile.log"), rotation="500 MB", level="DEBUG")
 
+    if FLAGS.profile:
+        PROFILER.enable()
+        atexit.register(lambda: logger.info("Processing stages:\n" + PROFILER.dump()))
+
     devices = [ARDUINO1]
-    sensors = Builder.irtouch32(devices=devices, data_directory='./data/irtouch', comm_mode="BLEAK")
+    sensors = Builder.irtouch32(devices=devices, data_directory='./data/irtouch', comm_mode="BLEAK",
+                                view_mode=FLAGS.view_mode, fit_mode=FLAGS.fit_mode)
 
     asyncio.get_event_loop().run_until_complete(sensors.subscribe_to_devices(visualiser_delay=0.01))
 
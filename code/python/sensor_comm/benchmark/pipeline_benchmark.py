@@ -0,0 +1,156 @@
+"""
+Throughput benchmark of the IRTouch32 pipeline: synthetic 32 byte frames are pushed through the callbacks of
+Builder.get_callbacks, wired as in Builder.irtouch32, i.e. IRTouchDataHandler.data_convert -> history ring buffer and
+frame statistics -> IRTouch32ViewModel.update_device_data -> DataHandler.persist, for a growing number of devices. No
+Bluetooth hardware is needed.
+
+With --view_mode=HEADLESS (the default) the edge detection runs on every frame and no display is needed, with
+--view_mode=TK the Tk view is created and, with --gui, redrawn.
+
+Example:
+    python pipeline_benchmark.py --num_devices=1,2,6,12 --frames_per_device=2000 --view_mode=TK --nogui
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from absl import app
+from absl import flags
+from loguru import logger
+
+from sensor_comm.communication.sim_comm import SimComm
+from sensor_comm.utils.builder import Builder
+from sensor_comm.utils.data_handler import IRTouchDataHandler
+from sensor_comm.utils.profiling import PROFILER
+from sensor_comm.visualisation.view.headless_view import HeadlessIRTouch32View
+from sensor_comm.visualisation.viewmodel.irtouch32_viewmodel import IRTouch32ViewModel
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list('num_devices', ['1', '2', '4', '6', '12'], 'Numbers of devices to benchmark.')
+flags.DEFINE_integer('frames_per_device', 1000, 'Number of frames pushed per device.')
+flags.DEFINE_enum('view_mode', 'HEADLESS', ['TK', 'HEADLESS'], 'View of the IRTouch32ViewModel.')
+flags.DEFINE_bool('gui', False, 'Redraw the Tk view while pushing frames, with --view_mode=TK.')
+flags.DEFINE_integer('redraw_every', 10, 'Number of frames between two redraws, if the GUI is on.')
+flags.DEFINE_enum('storage_mode', 'CSV', ['CSV', 'BINARY'], 'Storage mode of the DataHandler.')
+flags.DEFINE_integer('history_capacity', 256, 'Number of frames kept per device in the history, 0 to keep none.')
+flags.DEFINE_bool('allocations', True, 'Also run a pass with tracemalloc to measure memory allocations.')
+flags.DEFINE_string('data_directory', None, 'Directory to persist to, a temporary directory by default.')
+flags.DEFINE_string('output', None, 'Optional JSON file to write the results to.')
+flags.DEFINE_bool('profile', False, 'Also run a pass with the stage profiler enabled and print its summary.')
+
+GRID_SIZE = (5, 4, 5, 4, 5, 4, 5)
+
+
+def build_pipeline(devices, data_directory):
+    data_handler = IRTouchDataHandler(devices=devices, directory=data_directory, buffer_size=20,
+                                      grid_size=GRID_SIZE, storage_mode=FLAGS.storage_mode)
+    if FLAGS.view_mode == "TK":
+        from sensor_comm.visualisation.view.irtouch32_view import IRTouch32View
+        view = IRTouch32View(devices=devices, grid_size=GRID_SIZE)
+        if not FLAGS.gui:
+            view.withdraw()
+    else:
+        view = HeadlessIRTouch32View(devices=devices, grid_size=GRID_SIZE)
+    viewmodel = IRTouch32ViewModel(view, inline_analysis=FLAGS.view_mode == "HEADLESS")
+    history = Builder.get_history(devices, data_handler, FLAGS.history_capacity)
+    frame_stats = Builder.get_frame_stats(devices)
+    callbacks = Builder.get_callbacks(devices, data_handler, viewmodel, history, frame_stats)
+    return data_handler, viewmodel, callbacks
+
+
+def synthetic_packets(devices, callbacks, frames_per_device):
+    """
+    Pregenerated packets, interleaving the devices, so generating them is not part of the measurement
+    """
+    sim = SimComm(devices, callbacks, frame_size=sum(GRID_SIZE))
+    generators = {device: sim.packets(device) for device in devices}
+    return [(device, next(generators[device])) for _ in range(frames_per_device) for device in devices]
+
+
+async def push_frames(packets, callbacks, viewmodel):
+    """
+    Pushes all packets through the callbacks, yielding to the event loop after every frame so the tasks spawned by the
+    viewmodel get to run.
+    :return: (total time in s, array of per-frame callback latencies in ns)
+    """
+    latencies = np.zeros(len(packets), dtype=np.int64)
+    t_start = time.perf_counter()
+    for i, (device, packet) in enumerate(packets):
+        t_frame = time.perf_counter_ns()
+        callbacks[device](0, packet)
+        latencies[i] = time.perf_counter_ns() - t_frame
+        if FLAGS.gui and FLAGS.view_mode == "TK" and i % FLAGS.redraw_every == 0:
+            viewmodel.update_view()
+        await asyncio.sleep(0)
+    return time.perf_counter() - t_start, latencies
+
+
+def run_benchmark(num_devices, data_directory):
+    devices = [f"00:00:00:00:00:{i:02X}" for i in range(num_devices)]
+    data_handler, viewmodel, callbacks = build_pipeline(devices, data_directory)
+    packets = synthetic_packets(devices, callbacks, FLAGS.frames_per_device)
+
+    total_time, latencies = asyncio.run(push_frames(packets, callbacks, viewmodel))
+    result = {
+        'num_devices': num_devices,
+        'frames': len(packets),
+        'frames_per_s': len(packets) / total_time,
+        'latency_p50_us': np.percentile(latencies, 50) / 1e3,
+        'latency_p90_us': np.percentile(latencies, 90) / 1e3,
+        'latency_p99_us': np.percentile(latencies, 99) / 1e3,
+        'latency_max_us': latencies.max() / 1e3,
+    }
+
+    if FLAGS.allocations:
+        tracemalloc.start()
+        snapshot_before = tracemalloc.take_snapshot()
+        asyncio.run(push_frames(packets, callbacks, viewmodel))
+        snapshot_after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = snapshot_after.compare_to(snapshot_before, 'filename')
+        result['alloc_peak_kib'] = peak / 1024
+        result['alloc_net_bytes_per_frame'] = sum(stat.size_diff for stat in stats) / len(packets)
+
+    if FLAGS.profile:
+        PROFILER.reset()
+        PROFILER.enable()
+        asyncio.run(push_frames(packets, callbacks, viewmodel))
+        PROFILER.disable()
+        result['stages'] = PROFILER.summary()
+        print(f"Processing stages, {num_devices} devices:\n{PROFILER.dump()}")
+
+    data_handler.close()
+    view = viewmodel.view
+    view.destroy()
+    return result
+
+
+def main(_):
+    logger.configure(handlers=[{"sink": sys.stderr, "level": "WARNING"}])
+    data_directory = FLAGS.data_directory if FLAGS.data_directory else tempfile.mkdtemp(prefix='sensor_comm_bench')
+    os.makedirs(data_directory, exist_ok=True)
+
+    results = []
+    print(f"{'devices':>7} {'frames':>7} {'frames/s':>10} {'p50 us':>8} {'p90 us':>8} {'p99 us':>8} {'max us':>8}"
+          f" {'peak KiB':>9} {'net B/frame':>11}")
+    for num_devices in FLAGS.num_devices:
+        result = run_benchmark(int(num_devices), data_directory)
+        results.append(result)
+        print(f"{result['num_devices']:>7} {result['frames']:>7} {result['frames_per_s']:>10.0f}"
+              f" {result['latency_p50_us']:>8.1f} {result['latency_p90_us']:>8.1f} {result['latency_p99_us']:>8.1f}"
+              f" {result['latency_max_us']:>8.1f} {result.get('alloc_peak_kib', float('nan')):>9.1f}"
+              f" {result.get('alloc_net_bytes_per_frame', float('nan')):>11.1f}")
+
+    if FLAGS.output:
+        with open(FLAGS.output, 'w') as output_file:
+            json.dump({'view_mode': FLAGS.view_mode, 'gui': FLAGS.gui, 'storage_mode': FLAGS.storage_mode,
+                       'results': results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -1,17 +1,29 @@
 import asyncio
 import atexit
+import time
 from bleak import BleakClient
+from bleak.exc import BleakError
 from loguru import logger
 
 
 class BleakComm:
 
-    def __init__(self, devices, callbacks, data_char_uuid):
+    def __init__(self, devices, callbacks, data_char_uuid, max_concurrency=3, retries=3, retry_delay=1.0, timeout=5.0,
+                 supervise=True, stall_timeout=2.0, supervision_interval=0.5, max_reconnect_delay=30.0):
         """
         Upon initialisation, all devices denoted by the argument "devices" are connected to.
 
         :param devices: list of MAC addresses (string, e.g. D3:21:46:1B:B9:A0), one per device
         :param callbacks: dict, device (MAC address) -> callback function
+        :param max_concurrency: maximum number of devices that are connected to or subscribed to at the same time
+        :param retries: number of attempts to connect to or subscribe to a device
+        :param retry_delay: time in s before the second attempt, doubled for every next attempt
+        :param timeout: connection timeout in s, per attempt
+        :param supervise: once subscribed, reconnect and re-subscribe devices that disconnect or stop sending
+        notifications, in the background
+        :param stall_timeout: time in s without notifications after which a subscribed device is considered stalled
+        :param supervision_interval: time in s between two checks of the supervisor
+        :param max_reconnect_delay: upper limit in s of the backoff between two rounds of reconnection attempts
         """
 
         self.DATA_CHAR_UUID = data_char_uuid
@@ -19,27 +31,90 @@ class BleakComm:
         self.devices = devices
         self.callbacks = callbacks
         self.connections = {}
+        self.concurrency_limit = asyncio.Semaphore(max_concurrency)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+        self.supervise = supervise
+        self.stall_timeout = stall_timeout
+        self.supervision_interval = supervision_interval
+        self.max_reconnect_delay = max_reconnect_delay
+        self.supervisor = None
+        self.reconnections = {}  # device -> reconnection task
+        self.subscribed = {}  # device -> monotonic time of subscribing
+        self.disconnected = set()  # devices whose link dropped unexpectedly
+        self.closing = set()  # devices that are being disconnected on purpose
+        self.notification_handlers = {device: self._notification_handler(device) for device in devices}
+        self.last_notification = {device: None for device in devices}  # (monotonic time, epoch time)
+        self.notification_interval = {device: None for device in devices}  # running average, in s
+        self.open_gaps = {}  # device -> gap that has not ended yet
+        self.gaps = {device: [] for device in devices}
 
         @atexit.register
         def _cleanup():
             # This function cannot have "self" as an argument and is hence defined here in __init__
-            loop = asyncio.get_event_loop()
+            try:
+                loop = asyncio.get_event_loop_policy().get_event_loop()
+            except RuntimeError:
+                return  # the devices ran on a loop of asyncio.run, which is gone, whoever ran it disconnects them
+            if loop.is_closed() or loop.is_running():
+                return
             loop.run_until_complete(__cleanup())
 
         async def __cleanup():
             logger.warning("Interrupted, disconnecting devices")
             await self.disconnect_devices()
 
+    async def _retry(self, action, device):
+        """
+        Awaits action(device), holding one of the concurrency slots, and retries with exponential backoff on failure
+        :return: bool, whether the action eventually succeeded
+        """
+        delay = self.retry_delay
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with self.concurrency_limit:
+                    await action(device)
+                return True
+            except (BleakError, asyncio.TimeoutError, OSError) as e:
+                if attempt == self.retries:
+                    logger.error(f"{action.__name__} {device} failed after {attempt} attempts: {e}")
+                    return False
+                logger.warning(f"{action.__name__} {device} failed (attempt {attempt}/{self.retries}): {e}, "
+                               f"retrying in {delay} s")
+                await asyncio.sleep(delay)
+                delay *= 2
+
     async def connect_device(self, device):
-        self.connections[device] = BleakClient(device, timeout=5.0)
-        await self.connections[device].connect()
+        client = BleakClient(device, timeout=self.timeout,
+                             disconnected_callback=lambda client: self._on_disconnect(device, client))
+        await client.connect()
+        self.connections[device] = client
+        self.closing.discard(device)
         logger.debug("Connected to " + device)
 
+    def _on_disconnect(self, device, client):
+        # Clients that were replaced or disconnected on purpose are not of interest
+        if device in self.closing or self.connections.get(device) is not client:
+            return
+        logger.warning(f"Lost connection to {device}")
+        self.disconnected.add(device)
+
     async def connect_devices(self):
-        for device in self.devices:
-            await self.connect_device(device)
+        """
+        Connects to all devices concurrently, a device that can't be connected to doesn't hold up the others
+        :return: list of the devices that were connected to
+        """
+        connected = await asyncio.gather(*[self._retry(self.connect_device, device) for device in self.devices])
+        return [device for device, success in zip(self.devices, connected) if success]
 
     async def disconnect_device(self, device):
+        self.closing.add(device)
+        self.subscribed.pop(device, None)
+        reconnection = self.reconnections.pop(device, None)
+        if reconnection:
+            reconnection.cancel()
         try:
             await self.connections[device].disconnect()
             logger.debug("Disconnected from " + device)
@@ -50,32 +125,28 @@ class BleakComm:
         """
         Sequentially disconnect from all devices
         """
+        self.stop_supervisor()
         for device in self.devices:
             await self.disconnect_device(device)
 
-    async def subscribe_device(self, device, callback, w):
-        logger.debug("Starting " + device + " loop")
-        client = self.connections[device]
-        print( await client.get_services() )
-        await client.start_notify(self.DATA_CHAR_UUID, callback)
-        w.set()
-
-        while True:
-            await asyncio.sleep(5)
+    async def subscribe_device(self, device):
+        await self.connections[device].start_notify(self.DATA_CHAR_UUID, self.notification_handlers[device])
+        self.subscribed[device] = time.monotonic()
+        logger.debug("Subscribed to " + device)
 
     async def subscribe_devices(self):
         """
-        Subscribes to notifications on the data characteristic published by each device
-        TODO: the Event here is used to subscribe to the devices one after the other, as trying to do all in parallel
-        TODO: was unstable. This can probably be done by simply awaiting each self.subscribe_device
+        Subscribes to notifications on the data characteristic published by each connected device, concurrently
+        :return: list of the devices that were subscribed to
         """
-        w = asyncio.Event()
-        for device in self.devices:
-            asyncio.create_task(self.subscribe_device(device, self.callbacks[device], w))
-            await w.wait()
-            w.clear()
+        devices = [device for device in self.devices if device in self.connections]
+        subscribed = await asyncio.gather(*[self._retry(self.subscribe_device, device) for device in devices])
+        if self.supervise and self.supervisor is None:
+            self.supervisor = asyncio.create_task(self.supervise_devices())
+        return [device for device, success in zip(devices, subscribed) if success]
 
     async def unsubscribe_device(self, device):
+        self.subscribed.pop(device, None)
         try:
             await self.connections[device].stop_notify(self.DATA_CHAR_UUID)
             logger.debug("Unsubscribed from " + device)
@@ -86,6 +157,114 @@ class BleakComm:
         for device in self.devices:
             await self.unsubscribe_device(device)
 
+    def _notification_handler(self, device):
+        """
+        Wraps the callback of a device, to keep track of when its notifications arrive
+        """
+        callback = self.callbacks[device]
+
+        def handle_notification(handle, data):
+            now = time.monotonic()
+            if device in self.open_gaps:
+                self._close_gap(device, now)
+            elif self.last_notification[device] is not None:
+                interval = now - self.last_notification[device][0]
+                average = self.notification_interval[device]
+                self.notification_interval[device] = interval if average is None else 0.9 * average + 0.1 * interval
+            self.last_notification[device] = (now, time.time())
+            callback(handle, data)
+
+        return handle_notification
+
+    def _open_gap(self, device, reason):
+        now = time.monotonic()
+        if self.last_notification[device] is not None:
+            start, start_epoch = self.last_notification[device]
+        else:
+            start, start_epoch = now, time.time()
+        self.open_gaps[device] = {'start': start_epoch, 'start_monotonic': start, 'reason': reason}
+
+    def _close_gap(self, device, now):
+        gap = self.open_gaps.pop(device)
+        duration = now - gap.pop('start_monotonic')
+        gap['end'] = gap['start'] + duration
+        interval = self.notification_interval[device]
+        gap['frames_lost'] = max(0, round(duration / interval) - 1) if interval else None
+        self.gaps[device].append(gap)
+        logger.warning(f"Data of {device} resumed after {duration:.2f} s, about {gap['frames_lost']} frames lost")
+
+    async def supervise_devices(self):
+        """
+        Checks the subscribed devices periodically and reconnects, in the background, any device that disconnected or
+        of which no notification arrived within stall_timeout. The other devices keep streaming meanwhile.
+        """
+        while True:
+            await asyncio.sleep(self.supervision_interval)
+            now = time.monotonic()
+            for device, subscribe_time in list(self.subscribed.items()):
+                if device in self.reconnections:
+                    continue
+                last_notification = self.last_notification[device]
+                last_time = max(subscribe_time, last_notification[0]) if last_notification else subscribe_time
+                if device in self.disconnected:
+                    reason = "disconnected"
+                elif now - last_time > self.stall_timeout:
+                    reason = "stalled"
+                    logger.warning(f"No data from {device} for {now - last_time:.1f} s")
+                else:
+                    continue
+                if device not in self.open_gaps:
+                    self._open_gap(device, reason)
+                self.reconnections[device] = asyncio.create_task(self._reconnect(device))
+
+    async def _reconnect(self, device):
+        delay = self.retry_delay
+        try:
+            while True:
+                self.subscribed.pop(device, None)
+                client = self.connections.pop(device, None)
+                if client is not None:
+                    try:
+                        await client.disconnect()
+                    except (BleakError, asyncio.TimeoutError, OSError):
+                        pass
+                self.disconnected.discard(device)
+                if await self._retry(self.connect_device, device) and await self._retry(self.subscribe_device, device):
+                    logger.info(f"Reconnected to {device}")
+                    return
+                logger.warning(f"Reconnecting to {device} failed, trying again in {delay} s")
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, self.max_reconnect_delay)
+        finally:
+            self.reconnections.pop(device, None)
+
+    def stop_supervisor(self):
+        """
+        Stops the supervisor and any reconnection in progress
+        """
+        if self.supervisor is not None:
+            self.supervisor.cancel()
+            self.supervisor = None
+        for reconnection in self.reconnections.values():
+            reconnection.cancel()
+        self.reconnections = {}
+
+    def get_gaps(self, device=None):
+        """
+        :return: list of the gaps in the data of a device, or a dict device -> list of gaps if no device is given. A
+        gap is a dict with 'start' and 'end' (epoch time in s), 'reason' and 'frames_lost' (estimated from the
+        notification rate, None if that was unknown). Gaps that have not ended yet are not included.
+        """
+        if device is not None:
+            return list(self.gaps[device])
+        return {device: list(gaps) for device, gaps in self.gaps.items()}
+
+    def get_frames_lost(self):
+        """
+        :return: dict, device -> estimated number of frames lost in all gaps
+        """
+        return {device: sum(gap['frames_lost'] or 0 for gap in gaps) for device, gaps in self.gaps.items()}
+
     async def read_device(self, device):
         logger.debug("Attempting read from " + device)
         client = self.connections[device]
@@ -0,0 +1,169 @@
+import asyncio
+import csv
+import numpy as np
+from loguru import logger
+
+from sensor_comm.utils.recording import load_recording
+
+
+class SimComm:
+    """
+    Stand-in for BleakComm that needs no Bluetooth hardware: synthetic packets are pushed into the same callbacks, with
+    the same (handle, bytearray) arguments as bleak notifications.
+    """
+
+    def __init__(self, devices, callbacks, frame_size, rate=100, num_packets=None, seed=0):
+        """
+        :param devices: list of MAC addresses (string, e.g. D3:21:46:1B:B9:A0), one per simulated device
+        :param callbacks: dict, device (MAC address) -> callback function
+        :param frame_size: number of bytes per packet
+        :param rate: packets per second per device, None to push packets as fast as possible
+        :param num_packets: number of packets after which each device stops, None to never stop
+        :param seed: seed of the synthetic data
+        """
+        assert(len(devices) == len(callbacks))
+        self.devices = devices
+        self.callbacks = callbacks
+        self.frame_size = frame_size
+        self.rate = rate
+        self.num_packets = num_packets
+        self.seed = seed
+        self.connections = {}
+        self.streams = {}
+        self.packets_sent = {device: 0 for device in devices}
+
+    def packets(self, device):
+        """
+        Generates the packets of a device: a bright and a dark band of bytes that shift by one byte every packet, plus
+        some noise, so that the edge detection has something to work on.
+        """
+        rng = np.random.default_rng(self.seed + self.devices.index(device))
+        band = np.arange(self.frame_size) < self.frame_size // 2
+        shift = 0
+        while True:
+            noise = rng.integers(0, 16, self.frame_size)
+            data = np.where(np.roll(band, shift), 200 + noise, 40 + noise).astype(np.uint8)
+            yield bytearray(data.tobytes())
+            shift += 1
+
+    async def connect_device(self, device):
+        self.connections[device] = self.packets(device)
+        logger.debug("Connected to simulated " + device)
+
+    async def connect_devices(self):
+        for device in self.devices:
+            await self.connect_device(device)
+        return list(self.devices)
+
+    async def disconnect_device(self, device):
+        await self.unsubscribe_device(device)
+        self.connections.pop(device, None)
+        logger.debug("Disconnected from simulated " + device)
+
+    async def disconnect_devices(self):
+        for device in self.devices:
+            await self.disconnect_device(device)
+
+    async def _stream(self, device):
+        callback = self.callbacks[device]
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        for packet in self.connections[device]:
+            if self.num_packets is not None and self.packets_sent[device] >= self.num_packets:
+                break
+            callback(0, packet)
+            self.packets_sent[device] += 1
+            if self.rate:
+                next_time += 1 / self.rate
+                await asyncio.sleep(max(0.0, next_time - loop.time()))
+            else:
+                await asyncio.sleep(0)  # let other devices and tasks run
+        logger.debug(f"Simulated {device} stopped after {self.packets_sent[device]} packets")
+
+    async def subscribe_device(self, device):
+        self.streams[device] = asyncio.create_task(self._stream(device))
+
+    async def subscribe_devices(self):
+        for device in self.devices:
+            await self.subscribe_device(device)
+        return list(self.devices)
+
+    async def unsubscribe_device(self, device):
+        stream = self.streams.pop(device, None)
+        if stream:
+            stream.cancel()
+
+    async def unsubscribe_devices(self):
+        for device in self.devices:
+            await self.unsubscribe_device(device)
+
+    async def wait_until_done(self):
+        """
+        Waits until every device has pushed num_packets packets
+        """
+        await asyncio.gather(*self.streams.values(), return_exceptions=True)
+
+    async def read_device(self, device):
+        packet = next(self.connections[device], None)
+        if packet is None:
+            logger.warning(f"No more packets to read from simulated {device}")
+            return []
+        return list(packet)
+
+    async def read_devices(self):
+        data = {}
+        for device in self.devices:
+            data[device] = await self.read_device(device)
+        return data
+
+
+class ReplayComm(SimComm):
+    """
+    Stand-in for BleakComm that replays a recording made by a DataHandler (.csv or .bin) into the callbacks.
+    """
+
+    def __init__(self, devices, callbacks, recording, encode, rate=None, num_packets=None, repeat=False):
+        """
+        :param recording: path of the .csv or .bin recording
+        :param encode: function turning a recorded frame back into a packet, i.e. DataHandler.data_encode
+        :param rate: packets per second per device, None to push packets as fast as possible
+        :param repeat: start over at the end of the recording, instead of stopping
+        """
+        super().__init__(devices, callbacks, frame_size=None, rate=rate, num_packets=num_packets)
+        self.encode = encode
+        self.repeat = repeat
+        self.frames = self._load_frames(recording)
+
+    def _load_frames(self, recording):
+        if recording.endswith('.bin'):
+            records, recorded_devices = load_recording(recording)
+            device_column = records['device']
+            data_column = records['data']
+            frames = {recorded_device: data_column[device_column == device_idx]
+                      for device_idx, recorded_device in enumerate(recorded_devices)}
+        else:
+            frames = {}
+            with open(recording, newline='') as csv_file:
+                csv_reader = csv.reader(csv_file, delimiter=';')
+                next(csv_reader)  # header
+                for row in csv_reader:
+                    frames.setdefault(row[0], []).append([int(value) for value in row[2:]])
+            recorded_devices = list(frames)
+
+        device_frames = {}
+        for device_idx, device in enumerate(self.devices):
+            if device in frames:
+                device_frames[device] = frames[device]
+            elif device_idx < len(recorded_devices):
+                logger.warning(f"{device} is not in the recording, replaying {recorded_devices[device_idx]} instead")
+                device_frames[device] = frames[recorded_devices[device_idx]]
+            else:
+                raise ValueError(f"Recording {recording} has no data for {device}")
+        return device_frames
+
+    def packets(self, device):
+        while True:
+            for frame in self.frames[device]:
+                yield bytearray(self.encode(frame))
+            if not self.repeat:
+                return
@@ -0,0 +1,307 @@
+import asyncio
+import queue
+import threading
+import numpy as np
+from loguru import logger
+
+from sensor_comm.utils.calibration import Calibration
+from sensor_comm.utils.data_handler import IRTouchDataHandler
+from sensor_comm.utils.general import spawn_context
+from sensor_comm.utils.hex_grid import HexGridLayout
+from sensor_comm.utils.ring_buffer import FrameRingBuffer
+
+
+def run_fleet_worker(worker_idx, devices, options, results, commands, stop, publish_interval):
+    """
+    Entry point of a worker process: runs a headless IRTouch32 sensor group for a subset of the devices and
+    periodically sends the latest results of the devices that were analysed since the previous send, and the frames
+    that arrived since then, to the aggregator. New calibration baselines sent by the aggregator are applied in
+    between.
+    :param options: dict of keyword arguments for Builder.irtouch32
+    :param results: multiprocessing queue to the aggregator
+    :param commands: multiprocessing queue from the aggregator
+    :param stop: multiprocessing event, set by the aggregator to stop the worker
+    """
+    from sensor_comm.utils.builder import Builder  # imported here, the aggregator itself doesn't need it
+
+    group = Builder.irtouch32(devices, view_mode="HEADLESS", **options)
+    analysed = set()
+    group.add_analysis_listener(analysed.add)
+    sent_frames = {device: 0 for device in devices}
+
+    def new_frames():
+        """
+        :return: dict, device -> (timestamps, frames), copies of the frames that arrived since the previous send
+        """
+        frames = {}
+        for device in devices if group.history else ():
+            history = group.history[device]
+            num_new_frames = min(history.num_appended - sent_frames[device], len(history))
+            sent_frames[device] = history.num_appended
+            if num_new_frames:
+                timestamps, device_frames = history.window(num_new_frames)
+                frames[device] = (timestamps.copy(), device_frames.copy())
+        return frames
+
+    def apply_commands():
+        while True:
+            try:
+                command, argument = commands.get_nowait()
+            except queue.Empty:
+                return
+            if command == 'calibration':
+                for device, baseline in argument.items():
+                    group.viewmodel.calibration.set_baseline(device, baseline)
+
+    async def run():
+        subscription = asyncio.create_task(group.subscribe_to_devices())
+        try:
+            while not stop.is_set() and not subscription.done():
+                await asyncio.sleep(publish_interval)
+                apply_commands()
+                frames = new_frames()
+                if frames:
+                    results.put(('history', worker_idx, frames))
+                if analysed:
+                    results.put(('results', worker_idx,
+                                 {device: {**group.get_current_results(device),
+                                           'frame_stats': group.get_frame_stats(device),
+                                           'analysis_stats': group.get_analysis_stats(device)}
+                                  for device in analysed}))
+                    analysed.clear()
+        finally:
+            # Disconnect while the loop is still running, the atexit cleanup of the comm handler can't use it anymore
+            subscription.cancel()
+            await asyncio.gather(subscription, return_exceptions=True)
+            await group.comm_handler.disconnect_devices()
+
+    try:
+        asyncio.run(run())
+    finally:
+        group.viewmodel.close()
+        group.data_handler.close()
+        results.put(('stopped', worker_idx, None))
+
+
+class IRTouchFleet:
+    """
+    Spreads IRTouch32 devices over worker processes, each with its own comm handler, data handler and headless
+    pipeline (see Builder.irtouch32), so decoding, analysis and persistence of many devices use several cores. The
+    workers send their results and frames to this aggregator, which offers the same queries as IRTouchGroup, with
+    pixel coordinates (edge, corner and darkness centrepoint) in a layout of all devices of the fleet side by side,
+    as in an IRTouchGroup of all devices. Results and history arrive in batches, up to publish_interval late.
+    """
+
+    def __init__(self, device_groups, worker_options, publish_interval=0.01):
+        """
+        :param device_groups: list of lists of MAC addresses, one list per worker process
+        :param worker_options: list of dicts of keyword arguments for Builder.irtouch32, one dict per worker process,
+        they should at least give every worker its own data_directory. The grid_size and history_capacity of the first
+        one are also those of the fleet.
+        :param publish_interval: time in s between two batches of results sent by a worker
+        """
+        assert(len(device_groups) == len(worker_options))
+        self.device_groups = device_groups
+        self.devices = [device for devices in device_groups for device in devices]
+        self.results = {device: None for device in self.devices}
+        self.analysis_listeners = []
+        self.publish_interval = publish_interval
+        self.loop = None  # event loop on which the results are handled, the receiver thread if None
+
+        grid_size = worker_options[0].get('grid_size', (5, 4, 5, 4, 5, 4, 5))
+        history_capacity = worker_options[0].get('history_capacity', 256)
+        self.layout = HexGridLayout(grid_size, len(self.devices))
+        # Offset from the layout of the worker of each device to the layout of the fleet
+        self.offsets = {}
+        for devices in device_groups:
+            worker_layout = HexGridLayout(grid_size, len(devices))
+            for worker_device_idx, device in enumerate(devices):
+                self.offsets[device] = np.subtract(self.layout.tile_origin(self.devices.index(device)),
+                                                   worker_layout.tile_origin(worker_device_idx))
+        self.history = {device: FrameRingBuffer(history_capacity, dtype=IRTouchDataHandler.codec.dtype,
+                                                frame_size=sum(grid_size)) for device in self.devices} \
+            if history_capacity else None
+        self.calibration = Calibration(sum(grid_size))
+
+        context = spawn_context()
+        self.results_queue = context.Queue()
+        self.command_queues = [context.Queue() for _ in device_groups]
+        self.stop_event = context.Event()
+        self.workers = [context.Process(target=run_fleet_worker, name=f"IRTouchFleet worker {worker_idx}", daemon=True,
+                                        args=(worker_idx, devices, options, self.results_queue,
+                                              self.command_queues[worker_idx], self.stop_event, publish_interval))
+                        for worker_idx, (devices, options) in enumerate(zip(device_groups, worker_options))]
+        self.receiver = threading.Thread(target=self._receive, name="IRTouchFleet receiver", daemon=True)
+
+    @staticmethod
+    def split_devices(devices, num_workers):
+        """
+        Splits devices into at most num_workers contiguous groups of (nearly) equal size
+        """
+        num_workers = max(1, min(num_workers, len(devices)))
+        group_size, remainder = divmod(len(devices), num_workers)
+        groups = []
+        start = 0
+        for worker_idx in range(num_workers):
+            end = start + group_size + (worker_idx < remainder)
+            groups.append(devices[start:end])
+            start = end
+        return groups
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self.receiver.start()
+
+    def _receive(self):
+        running = set(range(len(self.workers)))
+        while running:
+            try:
+                message, worker_idx, worker_results = self.results_queue.get(timeout=1)
+            except queue.Empty:
+                for worker_idx in list(running):
+                    if not self.workers[worker_idx].is_alive():
+                        logger.error(f"Worker {worker_idx} ({self.device_groups[worker_idx]}) stopped unexpectedly")
+                        running.discard(worker_idx)
+                continue
+            if message == 'stopped':
+                running.discard(worker_idx)
+                continue
+            if self.loop is not None:
+                try:
+                    self.loop.call_soon_threadsafe(self._handle, message, worker_results)
+                    continue
+                except RuntimeError:
+                    pass  # the loop is closed
+            self._handle(message, worker_results)
+
+    def _handle(self, message, worker_results):
+        if message == 'history':
+            for device, (timestamps, frames) in worker_results.items():
+                for timestamp, frame in zip(timestamps, frames):
+                    self.history[device].append(frame, timestamp)
+            return
+        for device, results in worker_results.items():
+            self.results[device] = self._to_fleet_coordinates(device, results)
+            for listener in self.analysis_listeners:
+                listener(device)
+
+    def _to_fleet_coordinates(self, device, results):
+        """
+        Moves the pixel coordinates in the results of a device from the layout of its worker to the layout of the fleet
+        """
+        dx, dy = self.offsets[device]
+
+        def shift(params):
+            if params is None or not any(params[:2]):
+                return params  # no fit or no dark cells, there is nothing to move
+            return (params[0] + dx, params[1] + dy, *params[2:])
+
+        return {**results,
+                'edge_params': shift(results['edge_params']),
+                'corner_params': shift(results['corner_params']),
+                'darkness_centrepoint': shift(results['darkness_centrepoint'])}
+
+    async def subscribe_to_devices(self):
+        """
+        Starts the workers, which connect and subscribe to their devices, and waits until all of them have stopped.
+        Results are handled, and the analysis listeners called, on the event loop running this coroutine.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.start()
+        await asyncio.to_thread(self.receiver.join)
+
+    def close(self, timeout=5.0):
+        """
+        Stops the workers, which disconnect from their devices and write out their data
+        """
+        self.stop_event.set()
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join(timeout)
+            if worker.is_alive():
+                logger.warning(f"{worker.name} did not stop within {timeout} s, terminating it")
+                worker.terminate()
+        if self.receiver.is_alive():
+            self.receiver.join(timeout)
+
+    def _get_result(self, device, key, default):
+        results = self.results[device]
+        return results[key] if results else default
+
+    def get_current_corner_angles(self):
+        return {device: self.get_current_corner_angle(device) for device in self.devices}
+
+    def get_current_corner_angle(self, device):
+        return self._get_result(device, 'corner_angle', 0)
+
+    def get_current_edge_fit_errors(self):
+        return {device: self.get_current_edge_fit_error(device) for device in self.devices}
+
+    def get_current_edge_fit_error(self, device):
+        return self._get_result(device, 'edge_fit_error', 0)
+
+    def get_current_edge_params(self, device):
+        return self._get_result(device, 'edge_params', (0, 0, 0))
+
+    def get_current_corner_params(self, device):
+        return self._get_result(device, 'corner_params', (0, 0, 0, 0))
+
+    def get_current_results(self, device):
+        return self.results[device]
+
+    def get_history(self, device, num_frames=None):
+        """
+        Most recent frames of a device as received from its worker, see SensorGroup.get_history
+        """
+        return self.history[device].window(num_frames)
+
+    def get_recent_history(self, device, duration):
+        """
+        Frames of a device that arrived within a time span before its most recent frame, see SensorGroup.get_history
+        :param duration: time span in s
+        """
+        return self.history[device].window_since(int(duration * 1e9))
+
+    def get_frame_stats(self, device=None):
+        """
+        Statistics of the incoming frames as last reported by the workers, see SensorGroup.get_frame_stats
+        """
+        if device is not None:
+            return self._get_result(device, 'frame_stats', None)
+        return {device: self._get_result(device, 'frame_stats', None) for device in self.devices}
+
+    def get_analysis_stats(self, device=None):
+        """
+        Edge detection counters as last reported by the workers, see IRTouch32ViewModel.get_analysis_stats
+        """
+        if device is not None:
+            return self._get_result(device, 'analysis_stats', None)
+        return {device: self._get_result(device, 'analysis_stats', None) for device in self.devices}
+
+    async def capture_calibration(self, duration=1.0, path=None):
+        """
+        Captures a new baseline for every device from the frames streamed during the coming duration, while nothing
+        touches the sensors, and hands the baselines to the workers, see IRTouchGroup.capture_calibration.
+        :param duration: time in s
+        :param path: optional JSON file to save the calibration to, see calibration.Calibration.save
+        """
+        if self.history is None:
+            raise ValueError("Capturing a calibration needs the history of the frames, set a history_capacity")
+        await asyncio.sleep(duration + 2 * self.publish_interval)  # the last frames of the window arrive later
+        for device in self.devices:
+            _, frames = self.get_recent_history(device, duration)
+            self.calibration.capture_baseline(device, frames)
+        for devices, commands in zip(self.device_groups, self.command_queues):
+            commands.put(('calibration', {device: self.calibration.baselines[device] for device in devices
+                                          if device in self.calibration.baselines}))
+        if path:
+            self.calibration.save(path)
+
+    def add_analysis_listener(self, listener):
+        """
+        :param listener: function called with the device as argument whenever new results of that device arrive from
+        a worker. It is called on the event loop running subscribe_to_devices, or on the receiver thread if the fleet
+        was started with start.
+        """
+        self.analysis_listeners.append(listener)
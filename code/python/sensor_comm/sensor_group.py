@@ -1,4 +1,5 @@
 import asyncio
+import numpy as np
 
 from sensor_comm.utils.data_handler import *
 from sensor_comm.utils.general import data_bytes_to_uint16
@@ -9,21 +10,29 @@ class SensorGroup:
     Sensor base class
     """
 
-    def __init__(self, devices, viewmodel=None, data_handler=None, comm_handler=None):
+    def __init__(self, devices, viewmodel=None, data_handler=None, comm_handler=None, history=None, frame_stats=None):
+        """
+        :param history: optional dict, device -> ring_buffer.FrameRingBuffer, filled by the notification callbacks
+        :param frame_stats: optional dict, device -> frame_stats.FrameStats, updated by the notification callbacks
+        """
         self.devices = devices
         self.viewmodel = viewmodel
         self.data_handler = data_handler
         self.comm_handler = comm_handler
+        self.history = history
+        self.frame_stats = frame_stats
         self.current_data = None  # TODO: make sure that unused, remove
 
     async def subscribe_to_devices(self, visualiser_delay=0.05):
         """
-        subscribes to notifications on the data characteristic published by each sensor and optionally plots the data
+        subscribes to notifications on the data characteristic published by each sensor and optionally plots the data.
+        Without a view to draw (no viewmodel, or a headless view), nothing is polled and all processing is driven by
+        the notifications.
         """
         await self.comm_handler.connect_devices()
         await self.comm_handler.subscribe_devices()
 
-        if self.viewmodel:
+        if self.viewmodel and not getattr(self.viewmodel.view, 'headless', False):
             while True:
                 await asyncio.sleep(visualiser_delay)
                 self.viewmodel.update_view()
@@ -39,10 +48,37 @@ class SensorGroup:
                 self.data_handler.persist(data, device)
         return data
 
+    def get_history(self, device, num_frames=None):
+        """
+        Most recent frames of a device, as views into its ring buffer, so they are only valid for a limited number of
+        frames (see ring_buffer.FrameRingBuffer.window); copy them to keep them.
+        :param num_frames: number of most recent frames, all frames that are kept if None
+        :return: (timestamps, frames), arrays of shape (n,) and (n, num_values), oldest first, timestamps are
+        monotonic times in ns
+        """
+        return self.history[device].window(num_frames)
+
+    def get_recent_history(self, device, duration):
+        """
+        Frames of a device that arrived within a time span before its most recent frame, see get_history
+        :param duration: time span in s
+        """
+        return self.history[device].window_since(int(duration * 1e9))
+
+    def get_frame_stats(self, device=None):
+        """
+        Live statistics of the incoming frames, see frame_stats.FrameStats.summary
+        :return: dict of statistics of a device, or a dict device -> statistics if no device is given
+        """
+        if device is not None:
+            return self.frame_stats[device].summary()
+        return {device: stats.summary() for device, stats in self.frame_stats.items()}
+
 
 class IRTouchGroup(SensorGroup):
-    def __init__(self, devices, viewmodel=None, data_handler=None, comm_handler=None):
-        super().__init__(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler)
+    def __init__(self, devices, viewmodel=None, data_handler=None, comm_handler=None, history=None, frame_stats=None):
+        super().__init__(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler,
+                         history=history, frame_stats=frame_stats)
 
     def get_current_corner_angles(self):
         return self.viewmodel.corner_fit_angles
@@ -55,3 +91,57 @@ class IRTouchGroup(SensorGroup):
 
     def get_current_edge_fit_error(self, device):
         return self.viewmodel.edge_fit_errors[device]
+
+    def get_current_edge_params(self, device):
+        """
+        :return: (x0, y0, angle) of the straight edge fit
+        """
+        return self.viewmodel.view.edges_params[device]
+
+    def get_current_corner_params(self, device):
+        """
+        :return: (x0, y0, angle1, angle2) of the corner fit
+        """
+        return self.viewmodel.view.corner_params[device]
+
+    def add_analysis_listener(self, listener):
+        """
+        :param listener: function called with the device as argument whenever a new edge detection result of that
+        device is available, see IRTouch32ViewModel.add_analysis_listener
+        """
+        self.viewmodel.add_analysis_listener(listener)
+
+    def get_analysis_stats(self, device=None):
+        """
+        Number of frames analysed, coalesced and dropped by the edge detection, see
+        IRTouch32ViewModel.get_analysis_stats
+        """
+        return self.viewmodel.get_analysis_stats(device)
+
+    async def capture_calibration(self, duration=1.0, path=None):
+        """
+        Captures a new baseline for every device from the frames streamed during the coming duration, while nothing
+        touches the sensors. The frames are taken from the history, which should hold at least duration worth of
+        frames.
+        :param duration: time in s
+        :param path: optional JSON file to save the calibration to, see calibration.Calibration.save
+        """
+        if self.history is None:
+            raise ValueError("Capturing a calibration needs the history of the frames, set a history_capacity")
+        await asyncio.sleep(duration)
+        for device in self.devices:
+            _, frames = self.get_recent_history(device, duration)
+            self.viewmodel.calibration.capture_baseline(device, frames)
+        if path:
+            self.viewmodel.calibration.save(path)
+
+    def get_current_results(self, device):
+        """
+        :return: dict with the latest edge detection results and calibrated data of a device
+        """
+        return {'edge_params': tuple(self.get_current_edge_params(device)),
+                'edge_fit_error': self.get_current_edge_fit_error(device),
+                'corner_params': tuple(self.get_current_corner_params(device)),
+                'corner_angle': self.get_current_corner_angle(device),
+                'darkness_centrepoint': self.viewmodel.view.darkness_centrepoints[device],
+                'data': np.asarray(self.viewmodel.calibrated_data[device])}
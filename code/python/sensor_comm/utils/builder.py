@@ -1,133 +1,273 @@
-from sensor_comm.communication.bleak_comm import BleakComm
+import os
+from time import monotonic_ns
+
+from sensor_comm.communication.sim_comm import SimComm, ReplayComm
 from sensor_comm.utils.sensor_uuids import SensorUuids
+from sensor_comm.utils.ring_buffer import FrameRingBuffer
+from sensor_comm.utils.calibration import Calibration
+from sensor_comm.utils.frame_stats import FrameStats, monotonic_to_epoch_offset_ns
+from sensor_comm.utils.profiling import profiled
 
-from sensor_comm.visualisation.viewmodel.smart_textile_viewmodel import SmartTextileViewModel
-from sensor_comm.visualisation.viewmodel.irtouch_viewmodel import IRTouchViewModel
 from sensor_comm.visualisation.viewmodel.irtouch32_viewmodel import IRTouch32ViewModel
-from sensor_comm.visualisation.view.irtouch32_view import IRTouch32View
-from sensor_comm.visualisation.viewmodel.captouch_viewmodel import CapTouchViewmodel
-from sensor_comm.visualisation.viewmodel.capsense_viewmodel import CapSenseViewModel
-from sensor_comm.visualisation.viewmodel.cap2sense_viewmodel import Cap2SenseViewModel
-from sensor_comm.visualisation.viewmodel.poly_piezo_viewmodel import PolyPiezoViewModel
+from sensor_comm.visualisation.view.headless_view import HeadlessIRTouch32View
+from sensor_comm.visualisation.view.process_view import ProcessIRTouch32View
 from sensor_comm.sensor_group import *
+from sensor_comm.sensor_fleet import IRTouchFleet
 
 
 class Builder:
     @staticmethod
-    def get_callbacks(devices, data_handler, viewmodel):
+    def get_callbacks(devices, data_handler, viewmodel, history=None, frame_stats=None):
+        """
+        :param history: optional dict, device -> ring_buffer.FrameRingBuffer, to which each converted frame is appended
+        :param frame_stats: optional dict, device -> frame_stats.FrameStats, updated with the arrival time of each frame
+        """
+        epoch_offset_ns = monotonic_to_epoch_offset_ns()
+        data_convert = profiled('data_convert')(data_handler.data_convert)
+        persist = profiled('persist')(data_handler.persist)
+
         def handle_data(handle, value, device, data_handler, viewmodel):
             """
             :param handle: integer characteristic read handle the data was received on
             :param value: data returned in the notification as bytearray
             :param device: hardware address (str, e.g. "D3:21:46:1B:B9:A0") of the device to which this callback belongs
             """
-            data_bytes = list(value)
-            data_converted = data_handler.data_convert(data_bytes)
+            arrival_ns = monotonic_ns()
+            sequence = frame_stats[device].update(arrival_ns) if frame_stats else None
+            data_converted = data_convert(value)
             data_handler.current_data = data_converted
-            logger.debug([device] + data_converted)
+            logger.debug("{} {}", device, data_converted)
+            if history:
+                history[device].append(data_converted, arrival_ns)
             if viewmodel:
                 viewmodel.update_device_data(device, data_converted)
             if data_handler:
-                data_handler.persist(data_converted, device)
+                persist(data_converted, device, timestamp_ns=arrival_ns + epoch_offset_ns, sequence=sequence)
 
         callbacks = {device: lambda handle, value, device=device:
         handle_data(handle, value, device, data_handler=data_handler, viewmodel=viewmodel) for device in devices}
         return callbacks
 
+    @staticmethod
+    def get_frame_stats(devices):
+        """
+        :return: dict, device -> frame_stats.FrameStats
+        """
+        return {device: FrameStats() for device in devices}
+
+    @staticmethod
+    def get_history(devices, data_handler, history_capacity):
+        """
+        :param history_capacity: number of frames kept per device, 0 or None to keep no history
+        :return: dict, device -> ring_buffer.FrameRingBuffer, or None
+        """
+        if not history_capacity:
+            return None
+        return {device: FrameRingBuffer(history_capacity, dtype=data_handler.codec.dtype) for device in devices}
+
+    @staticmethod
+    def get_comm_handler(devices, callbacks, data_char_uuid, comm_mode, data_handler, frame_size, comm_options=None):
+        """
+        :param comm_mode: "BLEAK" for Bluetooth hardware, "SIM" for synthetic packets or "REPLAY" to replay a recording
+        :param frame_size: number of bytes per packet, for "SIM"
+        :param comm_options: dict of extra keyword arguments for the communication handler, e.g. {"rate": None} for
+        "SIM" or {"recording": path} for "REPLAY"
+        """
+        comm_options = comm_options if comm_options else {}
+        if comm_mode == "BLEAK":
+            from sensor_comm.communication.bleak_comm import BleakComm  # bleak is only needed for hardware
+            return BleakComm(devices, callbacks, data_char_uuid, **comm_options)
+        elif comm_mode == "SIM":
+            return SimComm(devices, callbacks, **{"frame_size": frame_size, **comm_options})
+        elif comm_mode == "REPLAY":
+            return ReplayComm(devices, callbacks, encode=data_handler.data_encode, **comm_options)
+        else:
+            raise ValueError("Invalid communication mode passed")
+
     @staticmethod
     def smart_textile(devices, grid_size=(7, 7), disp_vals=True, data_directory='/data/smart_textile', buffer_size=20,
-                      comm_mode="BLEAK"):
+                      comm_mode="BLEAK", storage_mode="CSV", flush_policy=None, comm_options=None,
+                      history_capacity=256):
         data_handler = SmartTexDataHandler(devices=devices, directory=data_directory, buffer_size=buffer_size,
-                                           grid_size=grid_size)
+                                           grid_size=grid_size, storage_mode=storage_mode,
+                                           flush_policy=flush_policy)
+        from sensor_comm.visualisation.view.square_grid_plot import SquareGridPlot
+        from sensor_comm.visualisation.viewmodel.smart_textile_viewmodel import SmartTextileViewModel
         view = SquareGridPlot(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
         viewmodel = SmartTextileViewModel(view)
-        if comm_mode == "BLEAK":
-            callbacks = Builder.get_callbacks(devices, data_handler, viewmodel)
-            comm_handler = BleakComm(devices, callbacks, SensorUuids.DATA_CHAR_SMARTTEX.value)
-        else:
-            ValueError("Invalid communication mode passed")
-        return SmartTextileGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler)
+        history = Builder.get_history(devices, data_handler, history_capacity)
+        frame_stats = Builder.get_frame_stats(devices)
+        callbacks = Builder.get_callbacks(devices, data_handler, viewmodel, history, frame_stats)
+        comm_handler = Builder.get_comm_handler(devices, callbacks, SensorUuids.DATA_CHAR_SMARTTEX.value, comm_mode,
+                                                data_handler, frame_size=1 + grid_size[0] * grid_size[1],
+                                                comm_options=comm_options)
+        return SmartTextileGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler,
+                                 history=history, frame_stats=frame_stats)
 
     @staticmethod
     def capsense(devices, grid_size=(5, 5), disp_vals=True, data_directory='/data/capsense', buffer_size=20,
-                 comm_mode="BLEAK"):
+                 comm_mode="BLEAK", storage_mode="CSV", flush_policy=None, comm_options=None,
+                 history_capacity=256):
         data_handler = CapSenseDataHandler(devices=devices, directory=data_directory, buffer_size=buffer_size,
-                                           grid_size=grid_size)
+                                           grid_size=grid_size, storage_mode=storage_mode,
+                                           flush_policy=flush_policy)
+        from sensor_comm.visualisation.view.square_grid_plot import SquareGridPlot
+        from sensor_comm.visualisation.viewmodel.capsense_viewmodel import CapSenseViewModel
         view = SquareGridPlot(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
         viewmodel = CapSenseViewModel(view)
-        if comm_mode == "BLEAK":
-            callbacks = Builder.get_callbacks(devices, data_handler, viewmodel)
-            comm_handler = BleakComm(devices, callbacks, SensorUuids.DATA_CHAR_IRTOUCH.value)
-        else:
-            ValueError("Invalid communication mode passed")
-        return CapSenseGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler)
+        history = Builder.get_history(devices, data_handler, history_capacity)
+        frame_stats = Builder.get_frame_stats(devices)
+        callbacks = Builder.get_callbacks(devices, data_handler, viewmodel, history, frame_stats)
+        comm_handler = Builder.get_comm_handler(devices, callbacks, SensorUuids.DATA_CHAR_IRTOUCH.value, comm_mode,
+                                                data_handler, frame_size=2 * grid_size[0] * grid_size[1],
+                                                comm_options=comm_options)
+        return CapSenseGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler,
+                             history=history, frame_stats=frame_stats)
 
     @staticmethod
     def cap2sense(devices, grid_size=(5, 5), disp_vals=True, data_directory='/data/cap2sense', buffer_size=20,
-                  comm_mode="BLEAK"):
+                  comm_mode="BLEAK", storage_mode="CSV", flush_policy=None, comm_options=None,
+                  history_capacity=256):
         data_handler = Cap2SenseDataHandler(devices=devices, directory=data_directory, buffer_size=buffer_size,
-                                            grid_size=grid_size)
+                                            grid_size=grid_size, storage_mode=storage_mode,
+                                            flush_policy=flush_policy)
+        from sensor_comm.visualisation.view.square_grid_plot import SquareGridPlot
+        from sensor_comm.visualisation.viewmodel.cap2sense_viewmodel import Cap2SenseViewModel
         view = SquareGridPlot(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
         viewmodel = Cap2SenseViewModel(view)
-        if comm_mode == "BLEAK":
-            callbacks = Builder.get_callbacks(devices, data_handler, viewmodel)
-            comm_handler = BleakComm(devices, callbacks, SensorUuids.DATA_CHAR_CAPSENSE.value)
-        else:
-            ValueError("Invalid communication mode passed")
-        return Cap2SenseGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler)
+        history = Builder.get_history(devices, data_handler, history_capacity)
+        frame_stats = Builder.get_frame_stats(devices)
+        callbacks = Builder.get_callbacks(devices, data_handler, viewmodel, history, frame_stats)
+        comm_handler = Builder.get_comm_handler(devices, callbacks, SensorUuids.DATA_CHAR_CAPSENSE.value, comm_mode,
+                                                data_handler, frame_size=2 * grid_size[0] * grid_size[1],
+                                                comm_options=comm_options)
+        return Cap2SenseGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler,
+                              history=history, frame_stats=frame_stats)
 
     @staticmethod
     def captouch(devices, cins, grid_size=(3, 2), disp_vals=True, data_directory='/data/captouch', buffer_size=20,
-                 comm_mode="BLEAK"):
+                 comm_mode="BLEAK", storage_mode="CSV", flush_policy=None, comm_options=None,
+                 history_capacity=256):
         data_handler = CapTouchDataHandler(devices=devices, cins=cins, directory=data_directory,
-                                           buffer_size=buffer_size, grid_size=grid_size)
+                                           buffer_size=buffer_size, grid_size=grid_size, storage_mode=storage_mode,
+                                           flush_policy=flush_policy)
+        from sensor_comm.visualisation.view.square_grid_plot import SquareGridPlot
+        from sensor_comm.visualisation.viewmodel.captouch_viewmodel import CapTouchViewmodel
         view = SquareGridPlot(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
         viewmodel = CapTouchViewmodel(view)
-        if comm_mode == "BLEAK":
-            callbacks = Builder.get_callbacks(devices, data_handler, viewmodel)
-            comm_handler = BleakComm(devices, callbacks, SensorUuids.DATA_CHAR_IRTOUCH.value)
-        else:
-            ValueError("Invalid communication mode passed")
-        return CapTouchGroup(devices, cins, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler)
+        history = Builder.get_history(devices, data_handler, history_capacity)
+        frame_stats = Builder.get_frame_stats(devices)
+        callbacks = Builder.get_callbacks(devices, data_handler, viewmodel, history, frame_stats)
+        comm_handler = Builder.get_comm_handler(devices, callbacks, SensorUuids.DATA_CHAR_IRTOUCH.value, comm_mode,
+                                                data_handler, frame_size=2 * len(cins),
+                                                comm_options=comm_options)
+        return CapTouchGroup(devices, cins, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler,
+                             history=history, frame_stats=frame_stats)
 
     @staticmethod
     def irtouch(devices, grid_size=(2, 2), disp_vals=True, data_directory='/data/irtouch', buffer_size=20,
-                comm_mode="BLEAK"):
+                comm_mode="BLEAK", storage_mode="CSV", flush_policy=None, comm_options=None,
+                history_capacity=256):
         data_handler = IRTouchDataHandler(devices=devices, directory=data_directory, buffer_size=buffer_size,
-                                          grid_size=grid_size)
+                                          grid_size=grid_size, storage_mode=storage_mode,
+                                          flush_policy=flush_policy)
+        from sensor_comm.visualisation.view.square_grid_plot import SquareGridPlot
+        from sensor_comm.visualisation.viewmodel.irtouch_viewmodel import IRTouchViewModel
         view = SquareGridPlot(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
         viewmodel = IRTouchViewModel(view)
-        if comm_mode == "BLEAK":
-            callbacks = Builder.get_callbacks(devices, data_handler, viewmodel)
-            comm_handler = BleakComm(devices, callbacks, SensorUuids.DATA_CHAR_CAPSENSE.value)
-        else:
-            ValueError("Invalid communication mode passed")
-        return IRTouchGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler)
+        history = Builder.get_history(devices, data_handler, history_capacity)
+        frame_stats = Builder.get_frame_stats(devices)
+        callbacks = Builder.get_callbacks(devices, data_handler, viewmodel, history, frame_stats)
+        comm_handler = Builder.get_comm_handler(devices, callbacks, SensorUuids.DATA_CHAR_CAPSENSE.value, comm_mode,
+                                                data_handler, frame_size=grid_size[0] * grid_size[1],
+                                                comm_options=comm_options)
+        return IRTouchGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler,
+                            history=history, frame_stats=frame_stats)
 
     @staticmethod
     def irtouch32(devices, grid_size=(5, 4, 5, 4, 5, 4, 5), disp_vals=True, data_directory='/data/irtouch', buffer_size=20,
-                comm_mode="BLEAK"):
+                comm_mode="BLEAK", storage_mode="CSV", flush_policy=None, comm_options=None,
+                history_capacity=256, view_mode="TK", calibration_file=None, fit_mode="INLINE", fit_options=None):
+        """
+        :param calibration_file: JSON file with the baselines of the devices (see IRTouchGroup.capture_calibration),
+        calibration.json in data_directory by default
+        :param view_mode: "TK" to draw the grids and edge detection in a window, "HEADLESS" to run the edge detection
+        on every incoming frame without a window, and without importing tkinter, "PROCESS" to do the same but draw
+        the results in a window that runs in a separate process
+        :param fit_mode: "INLINE", "THREAD" or "PROCESS", where the edge and corner fits run, see IRTouch32ViewModel
+        :param fit_options: dict of extra keyword arguments for IRTouch32ViewModel, e.g. {"refit_frame_delta": 2} to
+        skip the fits of frames that barely changed
+        """
+        fit_options = fit_options if fit_options else {}
         data_handler = IRTouchDataHandler(devices=devices, directory=data_directory, buffer_size=buffer_size,
-                                          grid_size=grid_size)
-        view = IRTouch32View(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
-        viewmodel = IRTouch32ViewModel(view)
-        if comm_mode == "BLEAK":
-            callbacks = Builder.get_callbacks(devices, data_handler, viewmodel)
-            comm_handler = BleakComm(devices, callbacks, SensorUuids.DATA_CHAR_IRTOUCH.value)
+                                          grid_size=grid_size, storage_mode=storage_mode,
+                                          flush_policy=flush_policy)
+        if view_mode == "TK":
+            from sensor_comm.visualisation.view.irtouch32_view import IRTouch32View
+            view = IRTouch32View(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
+        elif view_mode == "HEADLESS":
+            view = HeadlessIRTouch32View(devices=devices, grid_size=grid_size)
+        elif view_mode == "PROCESS":
+            view = ProcessIRTouch32View(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
         else:
-            ValueError("Invalid communication mode passed")
-        return IRTouchGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler)
+            raise ValueError("Invalid view mode passed")
+        if calibration_file is None:
+            calibration_file = os.path.join(data_directory, 'calibration.json')
+        calibration = Calibration.load(calibration_file, sum(grid_size), devices)
+        viewmodel = IRTouch32ViewModel(view, inline_analysis=view_mode != "TK", calibration=calibration,
+                                       fit_mode=fit_mode, **fit_options)
+        history = Builder.get_history(devices, data_handler, history_capacity)
+        frame_stats = Builder.get_frame_stats(devices)
+        callbacks = Builder.get_callbacks(devices, data_handler, viewmodel, history, frame_stats)
+        comm_handler = Builder.get_comm_handler(devices, callbacks, SensorUuids.DATA_CHAR_IRTOUCH.value, comm_mode,
+                                                data_handler, frame_size=sum(grid_size),
+                                                comm_options=comm_options)
+        return IRTouchGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler,
+                            history=history, frame_stats=frame_stats)
+
+    @staticmethod
+    def irtouch32_fleet(devices, num_workers=2, grid_size=(5, 4, 5, 4, 5, 4, 5), data_directory='/data/irtouch',
+                        buffer_size=20, comm_mode="BLEAK", storage_mode="CSV", flush_policy=None, comm_options=None,
+                        history_capacity=256, calibration_file=None, fit_mode="INLINE", fit_options=None):
+        """
+        IRTouch32 devices spread over worker processes, each running a headless Builder.irtouch32 pipeline for its
+        share of the devices and writing to its own subdirectory of data_directory (worker0, worker1, ...).
+        :param num_workers: number of worker processes
+        :param calibration_file: JSON file with the baselines of the devices, shared by the workers,
+        calibration.json in data_directory by default
+        :param fit_mode: where each worker runs its edge and corner fits, see Builder.irtouch32
+        :param fit_options: extra keyword arguments for the viewmodel of each worker, see Builder.irtouch32
+        """
+        if calibration_file is None:
+            calibration_file = os.path.join(data_directory, 'calibration.json')
+        device_groups = IRTouchFleet.split_devices(devices, num_workers)
+        worker_options = []
+        for worker_idx in range(len(device_groups)):
+            worker_directory = os.path.join(data_directory, f"worker{worker_idx}")
+            os.makedirs(worker_directory, exist_ok=True)  # a worker can't ask whether to create it
+            worker_options.append({"grid_size": grid_size, "data_directory": worker_directory,
+                                   "buffer_size": buffer_size, "comm_mode": comm_mode, "storage_mode": storage_mode,
+                                   "flush_policy": flush_policy, "comm_options": comm_options,
+                                   "history_capacity": history_capacity, "calibration_file": calibration_file,
+                                   "fit_mode": fit_mode, "fit_options": fit_options})
+        return IRTouchFleet(device_groups, worker_options)
 
     @staticmethod
     def poly_piezo(devices, grid_size=(5, 5), disp_vals=True, data_directory='/data/poly_piezo', buffer_size=20,
-                      comm_mode="BLEAK"):
+                      comm_mode="BLEAK", storage_mode="CSV", flush_policy=None, comm_options=None,
+                      history_capacity=256):
         data_handler = PolyPiezoDataHandler(devices=devices, directory=data_directory, buffer_size=buffer_size,
-                                           grid_size=grid_size)
+                                           grid_size=grid_size, storage_mode=storage_mode,
+                                           flush_policy=flush_policy)
+        from sensor_comm.visualisation.view.square_grid_plot import SquareGridPlot
+        from sensor_comm.visualisation.viewmodel.poly_piezo_viewmodel import PolyPiezoViewModel
         view = SquareGridPlot(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
         viewmodel = PolyPiezoViewModel(view)
-        if comm_mode == "BLEAK":
-            callbacks = Builder.get_callbacks(devices, data_handler, viewmodel)
-            comm_handler = BleakComm(devices, callbacks, SensorUuids.DATA_CHAR_POLYPIEZO.value)
-        else:
-            ValueError("Invalid communication mode passed")
-        return PolyPiezoGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler)
+        history = Builder.get_history(devices, data_handler, history_capacity)
+        frame_stats = Builder.get_frame_stats(devices)
+        callbacks = Builder.get_callbacks(devices, data_handler, viewmodel, history, frame_stats)
+        comm_handler = Builder.get_comm_handler(devices, callbacks, SensorUuids.DATA_CHAR_POLYPIEZO.value, comm_mode,
+                                                data_handler, frame_size=grid_size[0] * grid_size[1],
+                                                comm_options=comm_options)
+        return PolyPiezoGroup(devices, viewmodel=viewmodel, data_handler=data_handler, comm_handler=comm_handler,
+                              history=history, frame_stats=frame_stats)
@@ -0,0 +1,93 @@
+import json
+import os
+import numpy as np
+from loguru import logger
+
+
+def compile_calibration_lut(baseline):
+    """
+    Lookup table of the calibrated value of every possible 8 bit value of every taxel: value / baseline * 255, rounded
+    and clipped to 255, so that each taxel reads 255 at its own baseline.
+    :param baseline: (num_taxels,) array of baseline values
+    :return: (num_taxels, 256) uint8 array
+    """
+    baseline = np.maximum(np.asarray(baseline, dtype=float), 1)  # a dead taxel doesn't divide by zero
+    values = np.arange(256, dtype=float)
+    return np.minimum(np.rint(values[np.newaxis, :] / baseline[:, np.newaxis] * 255), 255).astype(np.uint8)
+
+
+class Calibration:
+    """
+    Per-device, per-taxel calibration of 8 bit sensor values w.r.t. a baseline captured from the device itself. Every
+    baseline is compiled into a lookup table once, so calibrating a frame is a single index operation. Devices without
+    a baseline use a baseline of 255, i.e. their values are left as they are.
+    """
+
+    def __init__(self, num_taxels, baselines=None):
+        """
+        :param num_taxels: number of values per frame
+        :param baselines: optional dict, device (MAC address) -> (num_taxels,) baseline values
+        """
+        self.num_taxels = num_taxels
+        self.baselines = {}
+        self.luts = {}
+        self.default_lut = compile_calibration_lut(np.full(num_taxels, 255)).ravel()
+        # Offset of the row of each taxel in a flattened lookup table
+        self.lut_offsets = np.arange(num_taxels) * 256
+        for device, baseline in (baselines or {}).items():
+            self.set_baseline(device, baseline)
+
+    def set_baseline(self, device, baseline):
+        baseline = np.clip(np.rint(np.asarray(baseline, dtype=float)), 0, 255).astype(np.uint8)
+        if baseline.shape != (self.num_taxels,):
+            raise ValueError(f"Baseline of {device} has shape {baseline.shape}, expected ({self.num_taxels},)")
+        self.baselines[device] = baseline
+        self.luts[device] = compile_calibration_lut(baseline).ravel()
+
+    def capture_baseline(self, device, frames):
+        """
+        Sets the baseline of a device to the mean of a window of frames, taken while nothing touches the sensor.
+        :param frames: (num_frames, num_taxels) array of uncalibrated values
+        """
+        frames = np.asarray(frames)
+        if not len(frames):
+            logger.warning(f"No frames of {device} to calibrate with, calibration unchanged")
+            return
+        self.set_baseline(device, frames.mean(axis=0))
+        logger.info(f"Calibrated {device} from {len(frames)} frames")
+
+    def apply(self, device, data):
+        """
+        :param data: (num_taxels,) uncalibrated 8 bit values
+        :return: (num_taxels,) uint8 array of calibrated values
+        """
+        lut = self.luts.get(device, self.default_lut)
+        return lut[self.lut_offsets + data]
+
+    def save(self, path):
+        """
+        Writes the baselines to a JSON file, keyed by MAC address. Baselines of other devices already in that file
+        are kept.
+        """
+        stored = {}
+        if os.path.exists(path):
+            with open(path) as calibration_file:
+                stored = json.load(calibration_file)
+        stored.update({device: baseline.tolist() for device, baseline in self.baselines.items()})
+        with open(path, 'w') as calibration_file:
+            json.dump(stored, calibration_file, indent=2)
+
+    @classmethod
+    def load(cls, path, num_taxels, devices=None):
+        """
+        :param path: JSON file written by save, if it doesn't exist no device is calibrated
+        :param devices: optional list of MAC addresses, only these devices are loaded
+        """
+        baselines = {}
+        if path and os.path.exists(path):
+            with open(path) as calibration_file:
+                baselines = json.load(calibration_file)
+            if devices is not None:
+                baselines = {device: baselines[device] for device in devices if device in baselines}
+            logger.debug(f"Loaded the calibration of {list(baselines)} from {path}")
+        return cls(num_taxels, baselines)
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class FrameCodec:
+    """
+    Converts the payload of a notification (bytes, bytearray or memoryview) into a typed NumPy array of taxel values
+    and back, with np.frombuffer rather than per-byte Python code. Decoded arrays own their memory, so they stay valid
+    when the payload buffer is reused.
+    """
+
+    def __init__(self, dtype=np.uint8, invert=False):
+        """
+        :param dtype: dtype of a single value in the payload, including its byte order, e.g. '<u2' for little endian
+        16 bit values
+        :param invert: values are sent inverted, i.e. as max - value, with max the largest value of dtype
+        """
+        self.dtype = np.dtype(dtype)
+        self.invert = invert
+        self.max_value = np.iinfo(self.dtype).max if invert else None
+
+    def _finish(self, values):
+        if self.invert:
+            return self.max_value - values  # a new array, of the same dtype
+        return values.copy()
+
+    def decode(self, payload):
+        """
+        :param payload: bytes of a single frame
+        :return: 1D array of the values in the frame
+        """
+        return self._finish(np.frombuffer(payload, dtype=self.dtype))
+
+    def decode_batch(self, payloads):
+        """
+        Decodes many frames of the same size in one call.
+        :param payloads: sequence of the bytes of single frames
+        :return: (num_frames, frame_size) array
+        """
+        if not len(payloads):
+            return np.zeros((0, 0), dtype=self.dtype)
+        values = np.frombuffer(b''.join(payloads), dtype=self.dtype)
+        return self._finish(values.reshape(len(payloads), -1))
+
+    def encode(self, data):
+        """
+        Inverse of decode
+        :param data: values of a single frame, or a (num_frames, frame_size) array of which the frames are concatenated
+        :return: bytes
+        """
+        values = np.asarray(data, dtype=self.dtype)
+        if self.invert:
+            values = self.max_value - values
+        return values.tobytes()
+
+
+UINT8 = FrameCodec(np.uint8)
+UINT8_INVERTED = FrameCodec(np.uint8, invert=True)
+UINT16_LE = FrameCodec('<u2')
@@ -1,10 +1,17 @@
+import atexit
 import itertools
 import os
 import csv
+import threading
+import numpy as np
 from loguru import logger
 from datetime import *
+from time import monotonic, time_ns
 
 from sensor_comm.utils.general import *
+from sensor_comm.utils.codecs import UINT8, UINT8_INVERTED, UINT16_LE
+from sensor_comm.utils.recording import BinaryRecorder
+from sensor_comm.utils.data_writer import DataWriter, FlushPolicy
 
 
 def create_unique_file_name(directory, preamble=None, extension='.csv'):
@@ -25,15 +32,41 @@ def create_unique_file_name(directory, preamble=None, extension='.csv'):
 
 
 class DataHandler:
-    def __init__(self, devices, directory, buffer_size=10):
+    codec = UINT8  # decodes packets into arrays of values, its dtype is also the dtype of binary recordings
+    writer_queue_size = 64  # maximum number of flushed buffers waiting for the writer thread
+
+    def __init__(self, devices, directory, buffer_size=10, storage_mode="CSV", flush_policy=None):
+        """
+        Frames are buffered and flushed to a writer thread, which does the actual file IO.
+        :param buffer_size: number of frames after which the buffer is flushed, if no flush_policy is given
+        :param storage_mode: "CSV" writes semicolon separated text, "BINARY" writes fixed-width records to a
+        memory-mapped file that can be opened with recording.load_recording
+        :param flush_policy: data_writer.FlushPolicy, when to flush the buffer
+        """
         self.directory = directory
         self.init_directory(self.directory)
-        self.file_name = create_unique_file_name(directory)
+        self.storage_mode = storage_mode
+        self.recorder = None
+        if storage_mode == "CSV":
+            self.file_name = create_unique_file_name(directory)
+        elif storage_mode == "BINARY":
+            self.file_name = create_unique_file_name(directory, extension='.bin')
+            self.recorder = BinaryRecorder(os.path.join(directory, self.file_name), devices, self.codec.dtype)
+        else:
+            raise ValueError("Invalid storage mode passed")
         self.csv_header = None
         self.buffer = []
-        self.max_buffer_size = buffer_size
+        self.buffer_lock = threading.RLock()  # the writer thread flushes a stalled buffer, see FlushPolicy
+        self.buffer_bytes = 0
+        self.last_flush_time = monotonic()
+        self.flush_policy = flush_policy if flush_policy else FlushPolicy(max_frames=buffer_size)
+        self.value_size = self.codec.dtype.itemsize
         self.devices = devices
         self.current_data = None
+        write = self._persist_to_recording if self.recorder else self._persist_to_file
+        self.writer = DataWriter(write, queue_size=self.writer_queue_size,
+                                 idle_interval=self.flush_policy.max_interval, on_idle=self._flush_if_stalled)
+        atexit.register(self.close)
 
     def init_directory(self, directory):
         """
@@ -50,7 +83,7 @@ class DataHandler:
                 raise ValueError("Invalid answer given, enter [Y] or [N].")
 
     def init_csv_file(self, directory, file_name):
-        if self.csv_header:
+        if self.csv_header and self.storage_mode == "CSV":
             with open(os.path.join(directory, file_name), 'w', newline='') as csv_file:
                 csv_writer = csv.writer(csv_file, delimiter=';')
                 csv_writer.writerow(self.csv_header)
@@ -63,29 +96,87 @@ class DataHandler:
         """
         raise NotImplementedError
 
-    def persist(self, data, device):
+    def data_encode(self, data):
+        """
+        Inverse of data_convert, turns converted data back into the bytes of a packet, e.g. to replay a recording.
+        """
+        raise NotImplementedError
+
+    def persist(self, data, device, timestamp_ns=None, sequence=None):
         """
         Persists a single readout from a single device
-        :param data: list, the data
+        :param data: array (or list) of values, as returned by data_convert
         :param device: string, the MAC address of the device
+        :param timestamp_ns: int, arrival time of the readout in ns since the epoch, the current time if None
+        :param sequence: int, sequence number of the readout per device, only stored in binary recordings
         """
-        self.buffer.append([device, datetime.now()] + data)
-
-        if len(self.buffer) > self.max_buffer_size:
-            self._persist_to_file()
+        if timestamp_ns is None:
+            timestamp_ns = time_ns()
+        if self.recorder:
+            frame = (data, device, timestamp_ns, sequence if sequence is not None else 0)
+        else:
+            frame = [device, datetime.fromtimestamp(timestamp_ns / 1e9)] + np.asarray(data).tolist()
+        with self.buffer_lock:
+            self.buffer.append(frame)
+            self.buffer_bytes += len(data) * self.value_size
+            if self.flush_policy.should_flush(len(self.buffer), self.buffer_bytes, monotonic() - self.last_flush_time):
+                self.flush()
+
+    def flush(self):
+        """
+        Hands the buffered frames to the writer thread
+        """
+        with self.buffer_lock:
+            if self.buffer:
+                self.writer.submit(self.buffer)
             self.buffer = []
+            self.buffer_bytes = 0
+            self.last_flush_time = monotonic()
+
+    def _flush_if_stalled(self):
+        """
+        Called on the writer thread when it has been idle for max_interval: flushes the buffer if no frame arrived to
+        trigger the time-based flush
+        """
+        with self.buffer_lock:
+            if self.buffer and monotonic() - self.last_flush_time > self.flush_policy.max_interval:
+                self.flush()
+
+    @property
+    def dropped_frames(self):
+        """
+        Number of frames that were not persisted because the writer thread could not keep up
+        """
+        return self.writer.dropped_frames
 
-    def _persist_to_file(self):
+    def _persist_to_file(self, rows):
         with open(os.path.join(self.directory, self.file_name), 'a+', newline='') as csv_file:
             csv_writer = csv.writer(csv_file, delimiter=';')
-            for row in self.buffer:
+            for row in rows:
                 csv_writer.writerow(row)
         logger.debug("Wrote to file")
 
+    def _persist_to_recording(self, frames):
+        for data, device, timestamp_ns, sequence in frames:
+            self.recorder.write(data, device, timestamp_ns, sequence)
+
+    def close(self):
+        """
+        Writes out whatever is still buffered and stops the writer thread, called at exit
+        """
+        self.flush()
+        self.writer.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.dropped_frames:
+            logger.warning(f"{self.dropped_frames} frames were dropped while writing to {self.file_name}")
+
 
 class SmartTexDataHandler(DataHandler):
-    def __init__(self, devices, directory="./data/smart_textile", buffer_size=10, grid_size=(7, 7)):
-        super().__init__(devices, directory, buffer_size=buffer_size)
+    def __init__(self, devices, directory="./data/smart_textile", buffer_size=10, grid_size=(7, 7),
+                 storage_mode="CSV", flush_policy=None):
+        super().__init__(devices, directory, buffer_size=buffer_size, storage_mode=storage_mode,
+                         flush_policy=flush_policy)
         grid_height = grid_size[0]
         grid_width = grid_size[1]
         self.csv_header = ['PCB addr', 'timestamp', 'LowBattery'] + \
@@ -94,12 +185,19 @@ class SmartTexDataHandler(DataHandler):
         self.init_csv_file(self.directory, self.file_name)
 
     def data_convert(self, data):
-        return data
+        return self.codec.decode(data)
+
+    def data_encode(self, data):
+        return self.codec.encode(data)
 
 
 class Cap2SenseDataHandler(DataHandler):
-    def __init__(self, devices, directory="./data/cap2sense", buffer_size=10, grid_size=(6, 6)):
-        super().__init__(devices, directory, buffer_size=buffer_size)
+    codec = UINT16_LE
+
+    def __init__(self, devices, directory="./data/cap2sense", buffer_size=10, grid_size=(6, 6),
+                 storage_mode="CSV", flush_policy=None):
+        super().__init__(devices, directory, buffer_size=buffer_size, storage_mode=storage_mode,
+                         flush_policy=flush_policy)
         self.grid_height = grid_size[0]
         self.grid_width = grid_size[1]
 
@@ -110,13 +208,20 @@ class Cap2SenseDataHandler(DataHandler):
         self.init_csv_file(self.directory, self.file_name)
 
     def data_convert(self, data):
-        data16 = data_bytes_to_uint16(data)
+        data16 = self.codec.decode(data)
         return data16
 
+    def data_encode(self, data):
+        return self.codec.encode(data)
+
 
 class CapSenseDataHandler(DataHandler):
-    def __init__(self, devices, directory="./data/capsense", buffer_size=10, grid_size=(6, 6)):
-        super().__init__(devices, directory, buffer_size=buffer_size)
+    codec = UINT16_LE
+
+    def __init__(self, devices, directory="./data/capsense", buffer_size=10, grid_size=(6, 6),
+                 storage_mode="CSV", flush_policy=None):
+        super().__init__(devices, directory, buffer_size=buffer_size, storage_mode=storage_mode,
+                         flush_policy=flush_policy)
         self.grid_height = grid_size[0]
         self.grid_width = grid_size[1]
 
@@ -128,7 +233,7 @@ class CapSenseDataHandler(DataHandler):
         self.init_csv_file(self.directory, self.file_name)
 
     def data_convert(self, data):
-        data16 = data_bytes_to_uint16(data)
+        data16 = self.codec.decode(data)
         '''data_converted = []
 
         connectivity_matrix = np.array([[0, 1, 1, 1, 1],
@@ -146,14 +251,20 @@ class CapSenseDataHandler(DataHandler):
         return data_converted'''
         return data16
 
+    def data_encode(self, data):
+        return self.codec.encode(data)
+
 
 class CapTouchDataHandler(DataHandler):
     """
         Writes to a buffer and periodically flushes to file system.
     """
+    codec = UINT16_LE
 
-    def __init__(self, devices, cins, directory="./data/captouch", buffer_size=10, grid_size=(3, 2)):
-        super().__init__(devices, directory, buffer_size=buffer_size)
+    def __init__(self, devices, cins, directory="./data/captouch", buffer_size=10, grid_size=(3, 2),
+                 storage_mode="CSV", flush_policy=None):
+        super().__init__(devices, directory, buffer_size=buffer_size, storage_mode=storage_mode,
+                         flush_policy=flush_policy)
         self.csv_header = ['PCB addr', 'timestamp', ]  # + self.cins
         self.init_csv_file(self.directory, self.file_name)
         self.cins = cins
@@ -162,26 +273,37 @@ class CapTouchDataHandler(DataHandler):
         assert(len(cins) == self.grid_width * self.grid_height)
 
     def data_convert(self, data):
-        return data_bytes_to_uint16(data)
+        return self.codec.decode(data)
+
+    def data_encode(self, data):
+        return self.codec.encode(data)
 
 
 class IRTouchDataHandler(DataHandler):
-    def __init__(self, devices, directory="./data/irtouch", buffer_size=10, grid_size=(3, 2)):
-        super().__init__(devices, directory, buffer_size=buffer_size)
+    codec = UINT8_INVERTED
+
+    def __init__(self, devices, directory="./data/irtouch", buffer_size=10, grid_size=(3, 2),
+                 storage_mode="CSV", flush_policy=None):
+        super().__init__(devices, directory, buffer_size=buffer_size, storage_mode=storage_mode,
+                         flush_policy=flush_policy)
         self.csv_header = ['MAC', 'timestamp']
         self.init_csv_file(self.directory, self.file_name)
 
     def data_convert(self, data):
         """
-        Data is 8bit, received from bytearray, no conversion needed.
+        Data is 8bit, received from bytearray, only inverted so that a higher value means more light.
         """
-        for i in range(len(data)):
-            data[i] = 255 - data[i]
-        return data
+        return self.codec.decode(data)
+
+    def data_encode(self, data):
+        return self.codec.encode(data)
+
 
 class PolyPiezoDataHandler(DataHandler):
-    def __init__(self, devices, directory="./data/smart_textile", buffer_size=10, grid_size=(7, 7)):
-        super().__init__(devices, directory, buffer_size=buffer_size)
+    def __init__(self, devices, directory="./data/smart_textile", buffer_size=10, grid_size=(7, 7),
+                 storage_mode="CSV", flush_policy=None):
+        super().__init__(devices, directory, buffer_size=buffer_size, storage_mode=storage_mode,
+                         flush_policy=flush_policy)
         grid_height = grid_size[0]
         grid_width = grid_size[1]
         self.csv_header = ['PCB addr', 'timestamp'] + \
@@ -190,4 +312,7 @@ class PolyPiezoDataHandler(DataHandler):
         self.init_csv_file(self.directory, self.file_name)
 
     def data_convert(self, data):
-        return data
+        return self.codec.decode(data)
+
+    def data_encode(self, data):
+        return self.codec.encode(data)
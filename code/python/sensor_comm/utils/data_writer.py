@@ -0,0 +1,103 @@
+import queue
+import threading
+from loguru import logger
+
+
+class FlushPolicy:
+    """
+    Decides when the frames buffered by a DataHandler are handed to its writer thread: as soon as any of the limits
+    is exceeded. Limits that are None are not checked.
+    """
+
+    def __init__(self, max_frames=10, max_bytes=None, max_interval=None):
+        """
+        :param max_frames: number of buffered frames
+        :param max_bytes: number of bytes of buffered taxel data
+        :param max_interval: time in s since the previous flush, checked when a frame arrives, and by the writer
+        thread while no frames arrive, so the last frames of a stalled stream are still written
+        """
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.max_interval = max_interval
+
+    def should_flush(self, num_frames, num_bytes, interval):
+        if self.max_frames is not None and num_frames > self.max_frames:
+            return True
+        if self.max_bytes is not None and num_bytes > self.max_bytes:
+            return True
+        if self.max_interval is not None and interval > self.max_interval:
+            return True
+        return False
+
+
+class DataWriter:
+    """
+    Writes batches of frames on a dedicated thread, fed by a bounded queue, so file IO never blocks the asyncio loop
+    that delivers the notifications. When the queue is full, batches are dropped and counted rather than waited for.
+    """
+
+    def __init__(self, write, queue_size=64, name="DataWriter", idle_interval=None, on_idle=None):
+        """
+        :param write: function writing a batch (list) of frames, called on the writer thread only
+        :param queue_size: maximum number of batches waiting to be written
+        :param idle_interval: time in s, whenever no batch arrived for this long, on_idle is called on the writer thread
+        :param on_idle: function without arguments, e.g. to flush what a stalled producer left buffered
+        """
+        self.write = write
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.idle_interval = idle_interval if on_idle else None
+        self.on_idle = on_idle
+        self.dropped_frames = 0  # updated by both the producer and the writer thread, under counter_lock
+        self.counter_lock = threading.Lock()
+        self.written_frames = 0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, batch):
+        """
+        Queues a batch of frames for writing without blocking
+        :return: bool, False if the batch was dropped because the queue was full
+        """
+        try:
+            self.queue.put_nowait(batch)
+            return True
+        except queue.Full:
+            dropped_frames = self._count_dropped(len(batch))
+            logger.warning(f"Writer queue full, dropped {len(batch)} frames ({dropped_frames} in total)")
+            return False
+
+    def _count_dropped(self, num_frames):
+        with self.counter_lock:
+            self.dropped_frames += num_frames
+            return self.dropped_frames
+
+    def _run(self):
+        while True:
+            try:
+                batch = self.queue.get(timeout=self.idle_interval)
+            except queue.Empty:
+                try:
+                    self.on_idle()
+                except Exception:
+                    logger.exception("Idle callback of the writer thread failed")
+                continue
+            if batch is None:
+                break
+            try:
+                self.write(batch)
+                self.written_frames += len(batch)
+            except Exception:
+                # Whatever went wrong with this batch, the thread carries on with the next one
+                dropped_frames = self._count_dropped(len(batch))
+                logger.exception(f"Writing {len(batch)} frames failed ({dropped_frames} dropped in total)")
+
+    def close(self, timeout=None):
+        """
+        Writes all queued batches and stops the writer thread
+        """
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.warning(f"Writer thread did not finish within {timeout} s, {self.queue.qsize()} batches left")
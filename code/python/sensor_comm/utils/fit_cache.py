@@ -0,0 +1,49 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class FitCache:
+    """
+    Least recently used cache of fit results, keyed on the set of points that was fitted, quantised to a resolution.
+    Point sets that only differ by less than the resolution share a result, so when a sensor keeps alternating
+    between a few states, as it does during a static grasp, each state is fitted only once.
+    """
+
+    def __init__(self, max_size=128, resolution=0.1):
+        """
+        :param max_size: number of results kept, 0 disables the cache
+        :param resolution: size of the quantisation step of the point coordinates
+        """
+        self.max_size = max_size
+        self.resolution = resolution
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, scope, xy):
+        """
+        :param scope: hashable that separates results that depend on more than the points, e.g. the device
+        :param xy: (n, 2) array of points
+        """
+        quantised = np.rint(np.asarray(xy, dtype=float) / self.resolution).astype(np.int64)
+        return scope, quantised.shape, quantised.tobytes()
+
+    def get(self, key):
+        """
+        :return: the cached result, None if there is none
+        """
+        result = self.results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.results.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        if not self.max_size:
+            return
+        self.results[key] = result
+        self.results.move_to_end(key)
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False)
@@ -0,0 +1,83 @@
+from time import monotonic_ns, time_ns
+
+
+def monotonic_to_epoch_offset_ns():
+    """
+    Offset that turns a time.monotonic_ns() reading into ns since the epoch. Taken once and kept, so timestamps derived
+    from it keep increasing even if the wall clock is adjusted.
+    """
+    return time_ns() - monotonic_ns()
+
+
+class FrameStats:
+    """
+    Live statistics of the frames of a single device, fed with the arrival time of every frame: a sequence number,
+    running averages of the inter-arrival interval and its jitter, and an estimate of the number of missing frames.
+
+    The packets carry no sequence number of their own, so missing frames are inferred from gaps: an interval that is
+    much longer than usual (by gap_factor, and by more than gap_jitters times the jitter, as BLE tends to deliver
+    notifications in bursts) counts as round(interval / usual interval) - 1 missing frames.
+    """
+
+    def __init__(self, smoothing=0.05, gap_factor=2.0, gap_jitters=4.0, warm_up=8, expected_rate=None):
+        """
+        :param smoothing: weight of a new interval in the running averages
+        :param gap_factor: an interval longer than gap_factor times the average interval may be a gap
+        :param gap_jitters: an interval must also exceed the average by gap_jitters times the jitter to be a gap
+        :param warm_up: number of intervals before gaps are detected
+        :param expected_rate: nominal frame rate in Hz, if known, used instead of the average interval to count
+        missing frames
+        """
+        self.smoothing = smoothing
+        self.gap_factor = gap_factor
+        self.gap_jitters = gap_jitters
+        self.warm_up = warm_up
+        self.expected_interval_ns = 1e9 / expected_rate if expected_rate else None
+        self.num_frames = 0
+        self.num_intervals = 0
+        self.last_arrival_ns = None
+        self.interval_ns = None
+        self.jitter_ns = 0.0
+        self.missing_frames = 0
+        self.num_gaps = 0
+
+    def update(self, arrival_ns):
+        """
+        :param arrival_ns: monotonic arrival time of a frame in ns
+        :return: the sequence number of the frame, counting from 0
+        """
+        sequence = self.num_frames
+        self.num_frames += 1
+        if self.last_arrival_ns is not None:
+            self._update_interval(arrival_ns - self.last_arrival_ns)
+        self.last_arrival_ns = arrival_ns
+        return sequence
+
+    def _update_interval(self, interval_ns):
+        if self.interval_ns is None:
+            self.interval_ns = float(interval_ns)
+            self.num_intervals = 1
+            return
+        usual_interval_ns = self.expected_interval_ns if self.expected_interval_ns else self.interval_ns
+        if self.num_intervals >= self.warm_up and usual_interval_ns > 0 and \
+                interval_ns > max(self.gap_factor * usual_interval_ns,
+                                  usual_interval_ns + self.gap_jitters * self.jitter_ns):
+            self.missing_frames += max(0, round(interval_ns / usual_interval_ns) - 1)
+            self.num_gaps += 1
+            return  # gaps are kept out of the running averages
+        deviation = abs(interval_ns - self.interval_ns)
+        self.interval_ns += self.smoothing * (interval_ns - self.interval_ns)
+        self.jitter_ns += self.smoothing * (deviation - self.jitter_ns)
+        self.num_intervals += 1
+
+    def summary(self):
+        """
+        :return: dict with the number of frames, the average rate (Hz), interval and jitter (ms), the number of gaps
+        and the estimated number of missing frames
+        """
+        return {'frames': self.num_frames,
+                'rate': 1e9 / self.interval_ns if self.interval_ns else None,
+                'interval_ms': self.interval_ns / 1e6 if self.interval_ns is not None else None,
+                'jitter_ms': self.jitter_ns / 1e6,
+                'gaps': self.num_gaps,
+                'missing_frames': self.missing_frames}
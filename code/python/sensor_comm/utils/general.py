@@ -1,3 +1,5 @@
+import functools
+import multiprocessing
 import matplotlib as mpl
 import numpy as np
 from loguru import logger
@@ -5,14 +7,22 @@ from loguru import logger
 
 def data_bytes_to_uint16(data_bytes):
     """
-    Converts a byte array or list into a list of 16b integers:
+    Converts a byte array or list into an array of 16b integers:
         [LSB1 MSB1 LSB2 MSB2 LSB3 MSB3 ...] -> [uint16_1, uint16_2, uint16_3 ...]
     """
     assert (len(data_bytes) % 2 == 0), f'Input array has length {len(data_bytes)}, cannot be converted'
-    data_uint16 = [data_bytes[2 * i] + data_bytes[2 * i + 1] * 2 ** 8 for i in range(len(data_bytes) // 2)]
+    data_uint16 = np.asarray(data_bytes, dtype=np.uint8).view('<u2').astype(np.uint16)
     return data_uint16
 
 
+def spawn_context():
+    """
+    Multiprocessing context for the child processes of the pipeline (view, fleet workers, fit workers). They are
+    spawned rather than forked, since a forked child would inherit the event loop and BLE state of its parent.
+    """
+    return multiprocessing.get_context('spawn')
+
+
 def color_fader(c1, c2, mix=0):  # fade (linear interpolate) from color c1 (at mix=0) to c2 (mix=1)
     if mix > 1:
         logger.warning("color_fader received mix value > 1")
@@ -31,6 +41,29 @@ def color_fader_rgb255(c1, c2, mix=0):
     return rgb255
 
 
+@functools.lru_cache(maxsize=None)
+def fill_color_lut(c1, c2):
+    """
+    Lookup table of the hex colour strings ("#rrggbb") of all 8 bit values, fading from c1 (at 0) to c2 (at 255) like
+    color_fader_rgb255. Built once per (c1, c2) pair, so colouring a frame is an array index.
+    """
+    lut = np.array(["#%02x%02x%02x" % tuple(color_fader_rgb255(c1, c2, mix=value / 255)) for value in range(256)])
+    lut.flags.writeable = False
+    return lut
+
+
+@functools.lru_cache(maxsize=None)
+def text_color_lut(c1, c2, light="#ededed", dark="#212121", brightness_threshold=150):
+    """
+    Lookup table of a legible text colour on top of the fill of all 8 bit values (see fill_color_lut): light text if
+    the brightness (HSV value, i.e. the largest RGB channel) of the fill is below the threshold, dark text otherwise.
+    """
+    lut = np.array([light if max(color_fader_rgb255(c1, c2, mix=value / 255)) < brightness_threshold else dark
+                    for value in range(256)])
+    lut.flags.writeable = False
+    return lut
+
+
 def constrain_rgb(rgb):
     for i in range(3):
         if rgb[i] > 255:
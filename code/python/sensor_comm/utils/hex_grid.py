@@ -0,0 +1,205 @@
+import functools
+import numpy as np
+
+
+def hex_grid_cells(grid_size):
+    """
+    Lists the (row, column) of every cell of a hexagonal grid, in the order in which the cells appear in a flattened
+    frame, i.e. column by column as defined in the __init__ of HexGridPlot.
+    :param grid_size: tuple, the amount of cells for each column
+    """
+    return [(row, column) for column, column_len in enumerate(grid_size) for row in range(column_len)]
+
+
+def hex_grid_index_arrays(grid_size):
+    """
+    :param grid_size: tuple, the amount of cells for each column
+    :return: (rows, columns), integer arrays holding the row and column of every cell of a flattened frame
+    """
+    cells = np.array(hex_grid_cells(grid_size), dtype=int)
+    return cells[:, 0], cells[:, 1]
+
+
+def hex_grid_neighbour_pairs(grid_size):
+    """
+    Lists all pairs of neighbouring cells that are checked for an edge, as indices into a flattened frame. For every
+    cell, the pairs are listed in the order (right up, right down, down). Only the columns left of the last one are
+    walked, so the pairs within the last column are not included.
+    :param grid_size: tuple, the amount of cells for each column
+    :return: (first, second), two integer arrays of equal length
+    """
+    column_starts = np.concatenate(([0], np.cumsum(grid_size)[:-1]))
+    first = []
+    second = []
+    for column, column_len in enumerate(grid_size[:-1]):
+        next_column_len = grid_size[column + 1]
+        if column_len > next_column_len:
+            right_offsets = (-1, 0)
+        elif column_len < next_column_len:
+            right_offsets = (0, 1)
+        else:
+            raise ValueError("Unexpected hexagonal grid definition: adjacent columns of equal size")
+        for row in range(column_len):
+            centre = column_starts[column] + row
+            for right_row in (row + right_offsets[0], row + right_offsets[1]):
+                if 0 <= right_row < next_column_len:
+                    first.append(centre)
+                    second.append(column_starts[column + 1] + right_row)
+            if row + 1 < column_len:
+                first.append(centre)
+                second.append(centre + 1)
+    return np.array(first, dtype=int), np.array(second, dtype=int)
+
+
+def edge_marker_coords(values, threshold, first, second, origins, vectors):
+    """
+    Places an edge marker on every neighbour pair whose values lie on either side of the threshold, interpolating
+    linearly between the centrepoints of both cells.
+    :param values: flattened frame
+    :param threshold: darkness threshold
+    :param first: indices of the first cell of each pair, as returned by hex_grid_neighbour_pairs
+    :param second: indices of the second cell of each pair
+    :param origins: (num_pairs, 2) array, centrepoint of the first cell of each pair
+    :param vectors: (num_pairs, 2) array, vector from the first to the second centrepoint of each pair
+    :return: (num_markers, 2) array of edge marker coordinates
+    """
+    return edge_marker_coords_batch(np.asarray(values)[np.newaxis], [threshold], first, second,
+                                    origins[np.newaxis], vectors[np.newaxis])[0]
+
+
+def edge_marker_coords_batch(frames, thresholds, first, second, origins, vectors):
+    """
+    edge_marker_coords of several frames (of several devices) at once, in one vectorised pass
+    :param frames: (num_frames, num_cells) array of flattened frames
+    :param thresholds: (num_frames,) darkness thresholds, a frame without a threshold (-1) gets no markers
+    :param first: indices of the first cell of each pair, as returned by hex_grid_neighbour_pairs
+    :param second: indices of the second cell of each pair
+    :param origins: (num_frames, num_pairs, 2) array, centrepoint of the first cell of each pair
+    :param vectors: (num_frames, num_pairs, 2) array, vector from the first to the second centrepoint of each pair
+    :return: list of (num_markers, 2) arrays of edge marker coordinates, one per frame
+    """
+    frames = np.asarray(frames, dtype=float)
+    thresholds = np.asarray(thresholds, dtype=float)[:, np.newaxis]
+    values1 = frames[:, first]
+    values2 = frames[:, second]
+    crossing = (np.minimum(values1, values2) <= thresholds) & (thresholds < np.maximum(values1, values2))
+    fraction = np.divide(thresholds - values1, values2 - values1, out=np.zeros_like(values1), where=crossing)
+    markers = origins + vectors * fraction[:, :, np.newaxis]
+    return [frame_markers[frame_crossing] for frame_markers, frame_crossing in zip(markers, crossing)]
+
+
+@functools.lru_cache(maxsize=None)
+def _hex_grid_topology(grid_size):
+    return HexGridTopology(grid_size)
+
+
+class HexGridTopology:
+    """
+    Everything about a hexagonal grid that depends on its grid_size only, derived once. Use HexGridTopology.get, which
+    shares one instance per grid_size between the views and viewmodels. All per-cell data are arrays in the order of
+    a flattened frame, so they scale to grids of any size without per-cell lookups.
+    """
+
+    def __init__(self, grid_size):
+        """
+        :param grid_size: tuple, the amount of cells for each column
+        """
+        self.grid_size = tuple(grid_size)
+        self.num_cells = sum(self.grid_size)
+        self.num_columns = len(self.grid_size)
+        self.cell_rows, self.cell_columns = hex_grid_index_arrays(self.grid_size)
+        self.column_starts = np.concatenate(([0], np.cumsum(self.grid_size)[:-1]))
+        # Flat index of the cell at [row, column], -1 outside the grid
+        self.cell_indices = np.full((max(self.grid_size), self.num_columns), -1, dtype=int)
+        self.cell_indices[self.cell_rows, self.cell_columns] = np.arange(self.num_cells)
+
+        # Pairs checked for an edge, at most one edge marker per pair
+        self.edge_pairs_first, self.edge_pairs_second = hex_grid_neighbour_pairs(self.grid_size)
+        self.marker_capacity = len(self.edge_pairs_first)
+
+        # All neighbours of every cell, including those within the last column, which the edge pairs leave out
+        last_column = self.column_starts[-1] + np.arange(self.grid_size[-1] - 1)
+        pairs_first = np.concatenate((self.edge_pairs_first, last_column))
+        pairs_second = np.concatenate((self.edge_pairs_second, last_column + 1))
+        neighbours = [[] for _ in range(self.num_cells)]
+        for first, second in zip(pairs_first.tolist(), pairs_second.tolist()):
+            neighbours[first].append(second)
+            neighbours[second].append(first)
+        self.adjacency = [np.array(sorted(cell_neighbours), dtype=int) for cell_neighbours in neighbours]
+
+        # Centrepoints w.r.t. the top left corner of the tile, for cells with a circumradius of 1
+        column_lengths = np.asarray(self.grid_size)[self.cell_columns]
+        self.unit_centrepoints = np.stack((1 + 3 / 2 * self.cell_columns,
+                                           np.sqrt(3) * (self.cell_rows + 1 - (column_lengths % 2) / 2)), axis=-1)
+        self.unit_tile_width = 2 * (self.num_columns * 3 / 4 + 1 / 4)
+        self.unit_tile_height = np.sqrt(3) * max(self.grid_size)
+
+    @staticmethod
+    def get(grid_size):
+        """
+        :return: the shared HexGridTopology of a grid_size
+        """
+        return _hex_grid_topology(tuple(grid_size))
+
+    def pixel_centrepoints(self, cell_circumradius, origin):
+        """
+        :param cell_circumradius: the radius of the circle circumscribing the cells, in pixels
+        :param origin: (x, y), the top left corner of the tile in pixels
+        :return: (num_cells, 2) array, the centrepoints of the cells in pixels
+        """
+        return np.asarray(origin, dtype=float) + self.unit_centrepoints * cell_circumradius
+
+    def cell_index(self, row, column):
+        """
+        :return: the index of the cell at (row, column) in a flattened frame
+        """
+        return self.cell_indices[row, column]
+
+
+class HexGridLayout:
+    """
+    Pixel geometry of the hexagonal grids drawn by HexGridPlot: one tile of cells per device, side by side, separated
+    by one cell width. Has no tkinter dependency, so the geometry is also available without a display.
+    """
+
+    def __init__(self, grid_size, num_devices, cell_circumradius=50):
+        """
+        :param grid_size: tuple, the amount of cells for each column
+        :param num_devices: number of tiles
+        :param cell_circumradius: the radius of the circle circumscribing the hexagonal cells, in pixels
+        """
+        self.topology = HexGridTopology.get(grid_size)
+        self.grid_size = grid_size
+        self.num_devices = num_devices
+        self.cell_circumradius = cell_circumradius
+        self.cell_inradius = cell_circumradius * np.sqrt(3) / 2  # the radius of the circle inscribing the cells
+        self.cell_width = 2 * self.cell_circumradius
+        self.cell_height = 2 * self.cell_inradius
+        self.tile_width = self.topology.unit_tile_width * cell_circumradius
+        self.tile_height = self.topology.unit_tile_height * cell_circumradius
+        self.width = (self.tile_width + self.cell_width) * num_devices + self.cell_width
+        self.height = self.tile_height * 1.5
+        self.cell_rows = self.topology.cell_rows
+        self.cell_columns = self.topology.cell_columns
+
+    def tile_origin(self, device_num):
+        """
+        :return: (x, y), the top left corner of the tile of a device
+        """
+        return self.cell_width + device_num * (self.tile_width + self.cell_width), self.cell_height
+
+    def cell_centrepoints(self, device_num):
+        """
+        :return: (num_cells, 2) array, the centrepoints of the cells of a device in the order of a flattened frame
+        """
+        return self.topology.pixel_centrepoints(self.cell_circumradius, self.tile_origin(device_num))
+
+    def tile_centre_x(self, device_num):
+        return self.cell_width + self.tile_width / 2 + device_num * (self.cell_width + self.tile_width)
+
+    def tile_bounds(self, device_num):
+        """
+        :return: ((x_min, y_min), (x_max, y_max)) of the tile of a device
+        """
+        x_min = self.cell_width + device_num * (self.cell_width + self.tile_width)
+        return (x_min, self.cell_height), (x_min + self.tile_width, self.cell_height + self.tile_height)
@@ -0,0 +1,159 @@
+import numpy as np
+
+
+def fit_line(xy):
+    """
+    Total least squares fit of a straight line through a set of points, i.e. the line minimising the sum of squared
+    orthogonal distances. It passes through the centroid of the points along their principal axis, which for 2D points
+    has a closed form, so no iterative solver is needed.
+    :param xy: (n, 2) array of points, n >= 2
+    :return: (centroid, angle, residuals), angle of the line in radians w.r.t. positive x in ]-pi/2, pi/2], residuals
+    the signed orthogonal distances of the points to the line
+    """
+    xy = np.asarray(xy, dtype=float)
+    centroid = xy.mean(axis=0)
+    dx = xy[:, 0] - centroid[0]
+    dy = xy[:, 1] - centroid[1]
+    angle = np.arctan2(2 * (dx @ dy), dx @ dx - dy @ dy) / 2
+    residuals = np.cos(angle) * dy - np.sin(angle) * dx
+    return centroid, angle, residuals
+
+
+def fit_line_at_x(xy, x0):
+    """
+    Fits a straight line through a set of points and expresses it as its height y0 at x = x0 and its angle. For a
+    (near) vertical line there is no such height, in which case the line is anchored at the centroid of the points.
+    The error is the mean of the standard errors of y0 and the angle (in degrees), which is the metric previously
+    obtained from the covariance estimate of scipy's curve_fit.
+    :param xy: (n, 2) array of points, n >= 2
+    :param x0: x at which the line is anchored
+    :return: (x0, y0, angle, error), angle in degrees w.r.t. positive x
+    """
+    centroid, angle, residuals = fit_line(xy)
+    num_points = len(residuals)
+    cos_angle = np.cos(angle)
+    if abs(cos_angle) < 1e-6:
+        x0 = centroid[0]
+        position = 0
+        cos_angle = 1
+    else:
+        position = (x0 - centroid[0]) / cos_angle  # position of the anchor along the line, w.r.t. the centroid
+    y0 = centroid[1] + position * np.sin(angle)
+
+    xy = np.asarray(xy, dtype=float)
+    spread = np.sum(((xy - centroid) @ [np.cos(angle), np.sin(angle)]) ** 2)
+    variance = residuals @ residuals / max(num_points - 2, 1)
+    if spread == 0:
+        return x0, y0, angle * 180 / np.pi, 0
+    angle_error = np.sqrt(variance / spread)
+    y0_error = np.sqrt(variance * (1 / num_points + position ** 2 / spread)) / abs(cos_angle)
+    return x0, y0, angle * 180 / np.pi, (y0_error + angle_error * 180 / np.pi) / 2
+
+
+def order_points_along_chain(xy):
+    """
+    Orders points so that consecutive points are neighbours along the curve they lie on, by walking greedily to the
+    nearest unvisited point, starting from the point furthest away from the centroid (i.e. one of the ends of the
+    curve).
+    :param xy: (n, 2) array of points
+    :return: (n, 2) array, the reordered points
+    """
+    xy = np.asarray(xy, dtype=float)
+    distances = np.linalg.norm(xy[:, np.newaxis, :] - xy[np.newaxis, :, :], axis=2)
+    idx = int(np.argmax(np.linalg.norm(xy - xy.mean(axis=0), axis=1)))
+    order = [idx]
+    distances[:, idx] = np.inf
+    for _ in range(len(xy) - 1):
+        idx = int(np.argmin(distances[idx]))
+        order.append(idx)
+        distances[:, idx] = np.inf
+    return xy[order]
+
+
+def half_line_distances(xy, corners, angles):
+    """
+    Distances from points to half-infinite lines, for many half-infinite lines at once.
+    :param xy: (n, 2) array of points
+    :param corners: (k, 2) array, the starting points of the half-infinite lines
+    :param angles: (k,) array, the directions of the half-infinite lines in radians w.r.t. positive x
+    :return: (k, n) array of distances
+    """
+    directions = np.stack((np.cos(angles), np.sin(angles)), axis=-1)
+    offsets = xy[np.newaxis, :, :] - corners[:, np.newaxis, :]
+    t = np.maximum(0, np.einsum('knd,kd->kn', offsets, directions))
+    return np.linalg.norm(offsets - t[:, :, np.newaxis] * directions[:, np.newaxis, :], axis=2)
+
+
+def fit_corner(xy, bounds=None, min_corner_sine=0.1, min_corner_angle=45):
+    """
+    Fits two half-infinite lines starting from a common point (x0, y0) through a set of points, as described in
+    IRTouch32ViewModel.corner_fitting_function. The points are ordered along the curve they lie on and every split of
+    that ordering into two parts of at least two points yields a candidate corner: the intersection of the closed-form
+    total least squares lines through both parts. A single straight line through all points is a candidate as well. The
+    candidate with the lowest sum of squared distances to its half-infinite lines wins. The cost is fixed for a given
+    number of points: there are no starting guesses and no iterations.
+    :param xy: (n, 2) array of points, n >= 2
+    :param bounds: optional ((x_min, y_min), (x_max, y_max)), the corner point is clipped to this box
+    :param min_corner_sine: if the sine of the angle between both lines of a candidate is smaller than this, the lines
+    are considered parallel and the corner is placed between both parts
+    :param min_corner_angle: candidates whose half-infinite lines enclose a smaller angle (in degrees) are discarded,
+    as they fold back onto themselves rather than describing a corner
+    :return: (x0, y0, angle1, angle2), angles in degrees w.r.t. positive x in [0, 360[
+    """
+    xy = order_points_along_chain(xy)
+    num_points = len(xy)
+    centroid, angle, _ = fit_line(xy)
+    corners = [centroid[np.newaxis, :]]
+    angles1 = [np.array([angle])]
+    angles2 = [np.array([angle + np.pi])]
+
+    if num_points >= 4:
+        # Scatter of every prefix, so the scatter of any part is the difference of two prefixes. The points are
+        # centred first to limit cancellation errors.
+        centred = xy - centroid
+        zeros = np.zeros((1, 2))
+        sums = np.concatenate((zeros, np.cumsum(centred, axis=0)))
+        products = np.concatenate((zeros, np.cumsum(centred ** 2, axis=0)))
+        cross_products = np.concatenate(([0], np.cumsum(centred[:, 0] * centred[:, 1])))
+        splits = np.arange(2, num_points - 1)
+
+        def part_line(start, end):
+            count = (end - start)[:, np.newaxis]
+            part_sums = sums[end] - sums[start]
+            part_products = products[end] - products[start] - part_sums ** 2 / count
+            part_cross_products = cross_products[end] - cross_products[start] - \
+                part_sums[:, 0] * part_sums[:, 1] / count[:, 0]
+            part_angles = np.arctan2(2 * part_cross_products, part_products[:, 0] - part_products[:, 1]) / 2
+            return centroid + part_sums / count, part_angles
+
+        centroids1, split_angles1 = part_line(np.zeros_like(splits), splits)
+        centroids2, split_angles2 = part_line(splits, np.full_like(splits, num_points))
+        v1 = np.stack((np.cos(split_angles1), np.sin(split_angles1)), axis=-1)
+        v2 = np.stack((np.cos(split_angles2), np.sin(split_angles2)), axis=-1)
+        sines = v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0]
+        parallel = np.abs(sines) < min_corner_sine
+        offsets = centroids2 - centroids1
+        t = (offsets[:, 0] * v2[:, 1] - offsets[:, 1] * v2[:, 0]) / np.where(parallel, 1, sines)
+        split_corners = np.where(parallel[:, np.newaxis], (xy[splits - 1] + xy[splits]) / 2,
+                                 centroids1 + v1 * t[:, np.newaxis])
+        if bounds is not None:
+            split_corners = np.clip(split_corners, bounds[0], bounds[1])
+        # Each half-infinite line points from the corner towards the points it was fitted to
+        split_angles1 = split_angles1 + np.pi * (np.einsum('kd,kd->k', centroids1 - split_corners, v1) < 0)
+        split_angles2 = split_angles2 + np.pi * (np.einsum('kd,kd->k', centroids2 - split_corners, v2) < 0)
+        corners.append(split_corners)
+        angles1.append(split_angles1)
+        angles2.append(split_angles2)
+
+    corners = np.concatenate(corners)
+    angles1 = np.concatenate(angles1)
+    angles2 = np.concatenate(angles2)
+    if bounds is not None:
+        corners[0] = np.clip(corners[0], bounds[0], bounds[1])
+    distances = np.minimum(half_line_distances(xy, corners, angles1), half_line_distances(xy, corners, angles2))
+    costs = np.sum(distances ** 2, axis=1)
+    enclosed_angles = np.abs((angles2 - angles1 + np.pi) % (2 * np.pi) - np.pi)
+    costs[enclosed_angles < min_corner_angle * np.pi / 180] = np.inf
+    best = np.argmin(costs)
+    return (corners[best, 0], corners[best, 1],
+            (angles1[best] * 180 / np.pi) % 360, (angles2[best] * 180 / np.pi) % 360)
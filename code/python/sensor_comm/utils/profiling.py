@@ -0,0 +1,108 @@
+import functools
+import json
+from time import perf_counter_ns
+
+
+class StageProfiler:
+    """
+    Collects the wall time spent per processing stage into histograms with power-of-two buckets: bucket b counts the
+    durations d (in ns) with 2 ** (b - 1) <= d < 2 ** b. Recording a duration is a few integer operations, so the
+    profiler can stay enabled while streaming. Disabled (the default), stages are not timed at all.
+    """
+
+    def __init__(self, num_buckets=40):
+        self.num_buckets = num_buckets
+        self.enabled = False
+        self.histograms = {}
+        self.totals = {}
+        self.maxima = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.histograms = {}
+        self.totals = {}
+        self.maxima = {}
+
+    def record(self, stage, duration_ns):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = [0] * self.num_buckets
+            self.totals[stage] = 0
+            self.maxima[stage] = 0
+        histogram[min(duration_ns.bit_length(), self.num_buckets - 1)] += 1
+        self.totals[stage] += duration_ns
+        if duration_ns > self.maxima[stage]:
+            self.maxima[stage] = duration_ns
+
+    def percentile(self, stage, percentage):
+        """
+        :return: upper bound in ns of the bucket holding the given percentile of the durations of a stage
+        """
+        histogram = self.histograms[stage]
+        rank = percentage / 100 * sum(histogram)
+        cumulative = 0
+        for bucket, count in enumerate(histogram):
+            cumulative += count
+            if count and cumulative >= rank:
+                return min(2 ** bucket, self.maxima[stage])
+        return self.maxima[stage]
+
+    def summary(self):
+        """
+        :return: dict, stage -> dict with the number of calls, the total time (ms) and the mean, percentiles (upper
+        bounds of their buckets) and maximum of the durations (us)
+        """
+        summary = {}
+        for stage, histogram in self.histograms.items():
+            count = sum(histogram)
+            summary[stage] = {'count': count,
+                              'total_ms': self.totals[stage] / 1e6,
+                              'mean_us': self.totals[stage] / count / 1e3,
+                              'p50_us': self.percentile(stage, 50) / 1e3,
+                              'p90_us': self.percentile(stage, 90) / 1e3,
+                              'p99_us': self.percentile(stage, 99) / 1e3,
+                              'max_us': self.maxima[stage] / 1e3}
+        return summary
+
+    def dump(self, path=None):
+        """
+        :param path: optional path of a JSON file to write the summary and the raw histograms to
+        :return: the summary as a table, slowest stage (by total time) first
+        """
+        summary = self.summary()
+        if path:
+            with open(path, 'w') as dump_file:
+                json.dump({'summary': summary, 'histograms': self.histograms}, dump_file, indent=2)
+        lines = [f"{'stage':<26} {'count':>8} {'total ms':>10} {'mean us':>9} {'p50 us':>9} {'p90 us':>9}"
+                 f" {'p99 us':>9} {'max us':>9}"]
+        for stage, stats in sorted(summary.items(), key=lambda item: -item[1]['total_ms']):
+            lines.append(f"{stage:<26} {stats['count']:>8} {stats['total_ms']:>10.1f} {stats['mean_us']:>9.1f}"
+                         f" {stats['p50_us']:>9.1f} {stats['p90_us']:>9.1f} {stats['p99_us']:>9.1f}"
+                         f" {stats['max_us']:>9.1f}")
+        return '\n'.join(lines)
+
+
+PROFILER = StageProfiler()
+
+
+def profiled(stage, profiler=PROFILER):
+    """
+    Decorator timing every call of a function as a stage of the profiler, if the profiler is enabled
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.record(stage, perf_counter_ns() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,117 @@
+import json
+import os
+import numpy as np
+from loguru import logger
+
+
+def record_dtype(value_dtype, frame_size, sequence=True):
+    """
+    Fixed-width record of a binary recording: arrival time in ns since the epoch, index of the device in the device
+    list, sequence number of the frame per device and the taxel values of a single frame.
+    :param sequence: include the sequence number, recordings made before it was added don't have it
+    """
+    fields = [('timestamp', '<i8'), ('device', '<u2')]
+    if sequence:
+        fields.append(('sequence', '<u4'))
+    return np.dtype(fields + [('data', np.dtype(value_dtype), (frame_size,))])
+
+
+def load_recording(path):
+    """
+    Opens a binary recording as a read-only structured NumPy array, without parsing or copying it.
+    :param path: path of the .bin file, the .json file describing it is expected next to it
+    :return: (records, devices), records has fields 'timestamp', 'device', 'sequence' and 'data', devices is the list
+    of MAC addresses indexed by the 'device' field
+    """
+    with open(path + '.json') as meta_file:
+        meta = json.load(meta_file)
+    dtype = record_dtype(meta['value_dtype'], meta['frame_size'], meta.get('sequence', False))
+    num_records = os.path.getsize(path) // dtype.itemsize
+    if not num_records:
+        return np.zeros(0, dtype=dtype), meta['devices']
+    records = np.memmap(path, dtype=dtype, mode='r', shape=(num_records,))
+
+    # A recording that was not closed properly still has its preallocated, zeroed tail
+    low, high = 0, num_records
+    while low < high:
+        mid = (low + high) // 2
+        if records['timestamp'][mid]:
+            low = mid + 1
+        else:
+            high = mid
+    return records[:low], meta['devices']
+
+
+class BinaryRecorder:
+    """
+    Writes frames as fixed-width records into a memory-mapped file, which is preallocated and grown in chunks.
+    """
+
+    def __init__(self, path, devices, value_dtype, chunk_size=4096):
+        """
+        :param path: path of the .bin file to write, a .json file describing the records is written next to it
+        :param devices: list of MAC addresses, records store the index of the device in this list
+        :param value_dtype: dtype of a single taxel value
+        :param chunk_size: number of records by which the file grows when it is full
+        """
+        self.path = path
+        self.devices = list(devices)
+        self.device_idx = {device: idx for idx, device in enumerate(self.devices)}
+        self.value_dtype = np.dtype(value_dtype)
+        self.chunk_size = chunk_size
+        self.dtype = None  # known once the first frame, and hence the frame size, arrives
+        self.records = None
+        self.capacity = 0
+        self.num_records = 0
+
+    def _create(self, frame_size):
+        self.dtype = record_dtype(self.value_dtype, frame_size)
+        with open(self.path + '.json', 'w') as meta_file:
+            json.dump({'devices': self.devices, 'value_dtype': self.value_dtype.str, 'frame_size': frame_size,
+                       'sequence': True}, meta_file)
+        open(self.path, 'wb').close()
+        self._grow()
+
+    def _grow(self):
+        if self.records is not None:
+            self.records.flush()
+            self.records = None
+        self.capacity += self.chunk_size
+        with open(self.path, 'r+b') as bin_file:
+            bin_file.truncate(self.capacity * self.dtype.itemsize)
+        self.records = np.memmap(self.path, dtype=self.dtype, mode='r+', shape=(self.capacity,))
+
+    def write(self, data, device, timestamp_ns, sequence=0):
+        """
+        :param data: taxel values of a single frame
+        :param device: string, the MAC address of the device
+        :param timestamp_ns: int, time in ns since the epoch
+        :param sequence: int, sequence number of the frame per device
+        """
+        if self.dtype is None:
+            self._create(len(data))
+        elif len(data) != self.dtype['data'].shape[0]:
+            logger.error(f"Frame of {len(data)} values from {device} does not fit a record of "
+                         f"{self.dtype['data'].shape[0]} values, not recorded")
+            return
+        if self.num_records == self.capacity:
+            self._grow()
+        record = self.records[self.num_records]
+        record['timestamp'] = timestamp_ns
+        record['device'] = self.device_idx[device]
+        record['sequence'] = sequence
+        record['data'] = data
+        self.num_records += 1
+
+    def close(self):
+        """
+        Flushes the records to disk and cuts off the unused, preallocated part of the file.
+        """
+        if self.records is None:
+            return
+        self.records.flush()
+        self.records = None
+        with open(self.path, 'r+b') as bin_file:
+            bin_file.truncate(self.num_records * self.dtype.itemsize)
+        self.capacity = self.num_records
+        logger.debug(f"Closed recording {self.path} with {self.num_records} records")
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class FrameRingBuffer:
+    """
+    Fixed-capacity history of the frames of a single device, with their arrival times. Every frame is written twice,
+    at position i and i + capacity of an array twice the capacity, so the most recent frames are always a contiguous
+    slice of that array and windows are returned as views, without copying.
+
+    There must be a single writer (the notification callback of the device). Readers running on the same event loop
+    always see complete frames. A returned window is only valid until capacity - len(window) more frames are appended,
+    copy it to keep it for longer.
+    """
+
+    def __init__(self, capacity, dtype=np.uint8, frame_size=None):
+        """
+        :param capacity: maximum number of frames kept
+        :param dtype: dtype of a single value
+        :param frame_size: number of values per frame, if None the memory is allocated when the first frame arrives
+        """
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.frames = None
+        self.timestamps = None
+        self.head = 0  # position of the next frame, in [0, capacity[
+        self.num_appended = 0
+        if frame_size is not None:
+            self._allocate(frame_size)
+
+    def _allocate(self, frame_size):
+        self.frames = np.zeros((2 * self.capacity, frame_size), dtype=self.dtype)
+        self.timestamps = np.zeros(2 * self.capacity, dtype=np.int64)
+
+    def __len__(self):
+        return min(self.num_appended, self.capacity)
+
+    def append(self, data, timestamp_ns):
+        """
+        :param data: values of a single frame
+        :param timestamp_ns: int, arrival time of the frame in ns, non-decreasing
+        """
+        if self.frames is None:
+            self._allocate(len(data))
+        head = self.head
+        self.frames[head] = data
+        self.frames[head + self.capacity] = data
+        self.timestamps[head] = timestamp_ns
+        self.timestamps[head + self.capacity] = timestamp_ns
+        self.head = head + 1 if head + 1 < self.capacity else 0
+        self.num_appended += 1
+
+    def window(self, num_frames=None):
+        """
+        :param num_frames: number of most recent frames, all frames in the buffer if None
+        :return: (timestamps, frames), views of shape (n,) and (n, frame_size), oldest frame first
+        """
+        size = len(self)
+        num_frames = size if num_frames is None else min(num_frames, size)
+        if self.frames is None:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=self.dtype)
+        end = self.head + self.capacity
+        return self.timestamps[end - num_frames:end], self.frames[end - num_frames:end]
+
+    def window_since(self, duration_ns):
+        """
+        :param duration_ns: time span in ns, w.r.t. the most recent frame
+        :return: (timestamps, frames) of the frames that arrived within duration_ns of the most recent one, see window
+        """
+        timestamps, frames = self.window()
+        if not len(timestamps):
+            return timestamps, frames
+        start = np.searchsorted(timestamps, timestamps[-1] - duration_ns, side='left')
+        return timestamps[start:], frames[start:]
+
+    def latest(self):
+        """
+        :return: (timestamp, frame) of the most recent frame, or (None, None) if the buffer is empty
+        """
+        if not self.num_appended:
+            return None, None
+        last = self.head + self.capacity - 1
+        return int(self.timestamps[last]), self.frames[last]
@@ -0,0 +1,70 @@
+import asyncio
+from loguru import logger
+
+
+class LatestValueScheduler:
+    """
+    Runs an expensive processing step on the event loop for keys (devices) that have new data, without ever queueing
+    stale work: while a key waits to be processed, newer submissions of it are coalesced into one, so the step always
+    sees the most recent data. All keys that are waiting are processed together in one batch. There is no delay
+    between batches other than yielding to the event loop once, so the processing rate follows the rate of the data
+    as long as the step keeps up, and degrades to the rate of the step if it doesn't.
+    """
+
+    def __init__(self, process, keys=()):
+        """
+        :param process: coroutine function called with the list of keys to process, it reads the latest data itself
+        :param keys: keys to keep counters for from the start, other keys are added when first submitted
+        """
+        self.process = process
+        self.pending = {}  # insertion ordered set
+        self.task = None
+        self.processed = {key: 0 for key in keys}
+        self.coalesced = {key: 0 for key in keys}
+        self.dropped = {key: 0 for key in keys}
+
+    def submit(self, key):
+        """
+        Marks new data of a key, to be processed as soon as the current batch, if any, is done
+        """
+        if key in self.pending:
+            self.coalesced[key] = self.coalesced.get(key, 0) + 1
+        else:
+            self.pending[key] = None
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while self.pending:
+            keys = list(self.pending)
+            self.pending.clear()
+            try:
+                await self.process(keys)
+            except Exception:
+                logger.exception(f"Processing {keys} failed")
+                for key in keys:
+                    self.dropped[key] = self.dropped.get(key, 0) + 1
+            else:
+                for key in keys:
+                    self.processed[key] = self.processed.get(key, 0) + 1
+            await asyncio.sleep(0)  # let the notifications that arrived in the meantime be handled
+
+    def stop(self):
+        """
+        Cancels the current batch, the data that is still waiting is counted as dropped
+        """
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        for key in self.pending:
+            self.dropped[key] = self.dropped.get(key, 0) + 1
+        self.pending.clear()
+
+    def summary(self):
+        """
+        :return: dict, key -> dict with the number of processed, coalesced (superseded by newer data before being
+        processed) and dropped (discarded unprocessed, by stop or a failing batch) submissions
+        """
+        keys = list(dict.fromkeys([*self.processed, *self.coalesced, *self.dropped]))
+        return {key: {'processed': self.processed.get(key, 0),
+                      'coalesced': self.coalesced.get(key, 0),
+                      'dropped': self.dropped.get(key, 0)} for key in keys}
@@ -0,0 +1,41 @@
+import numpy as np
+
+from sensor_comm.utils.hex_grid import HexGridLayout
+
+
+class HeadlessIRTouch32View:
+    """
+    Stand-in for IRTouch32View without tkinter and without a window: it has the same geometry and holds the same state
+    (cell values and edge detection overlays) that IRTouch32ViewModel writes to, but never draws anything. Used to run
+    the edge detection on machines without a display.
+    """
+    headless = True
+
+    def __init__(self, devices=None, grid_size=(5, 4, 5, 4, 5, 4, 5)):
+        self.devices = devices
+        self.grid_size = grid_size
+        self.layout = HexGridLayout(grid_size, len(devices))
+        self.topology = self.layout.topology
+        self.cell_circumradius = self.layout.cell_circumradius
+        self.cell_inradius = self.layout.cell_inradius
+        self.cell_width = self.layout.cell_width
+        self.cell_height = self.layout.cell_height
+        self.tile_width = self.layout.tile_width
+        self.tile_height = self.layout.tile_height
+
+        self.cell_rows = self.layout.cell_rows
+        self.cell_columns = self.layout.cell_columns
+        self.hex_values = {device: np.zeros(self.topology.num_cells, dtype=np.uint8) for device in devices}
+        self.cell_centrepoints = {device: self.layout.cell_centrepoints(device_num)
+                                  for device_num, device in enumerate(devices)}
+
+        self.edge_marker_centrepoints = {device: np.empty((0, 2)) for device in devices}
+        self.edges_params = {device: (0, 0, 0) for device in devices}
+        self.corner_params = {device: (0, 0, 0, 0) for device in devices}
+        self.darkness_centrepoints = {device: (0, 0) for device in devices}
+
+    def update_view(self):
+        pass
+
+    def destroy(self):
+        pass
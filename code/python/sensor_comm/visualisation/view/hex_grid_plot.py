@@ -1,14 +1,15 @@
 import tkinter as tk
 import numpy as np
-import matplotlib as mpl
 from loguru import logger
-from sensor_comm.utils.general import color_fader_rgb255
+from sensor_comm.utils.general import fill_color_lut, text_color_lut
+from sensor_comm.utils.hex_grid import HexGridLayout
 
 
 class HexGridPlot(tk.Tk):
     """
     This class will plot RGB (8 bit!) data in a grid.
     """
+    headless = False
 
     def __init__(self, devices=None, grid_size=(5, 4, 5, 4, 5, 4, 5), disp_vals=True, c1='#000000', c2='#FFFFFF'):
         """
@@ -35,16 +36,19 @@ class HexGridPlot(tk.Tk):
         self.disp_vals = disp_vals
         self.c1 = c1
         self.c2 = c2
+        self.fill_lut = fill_color_lut(c1, c2)
+        self.text_color_lut = text_color_lut(c1, c2)
 
-        self.cell_circumradius = 50  # the radius of de circle circumscribing the hexagonal cells
-        self.cell_inradius = self.cell_circumradius * np.sqrt(3) / 2  # the radius of de circle inscribing the
-        # hexagonal cells
-        self.cell_width = 2 * self.cell_circumradius
-        self.cell_height = 2 * self.cell_inradius
-        self.tile_width = (len(self.grid_size) * 3 / 4 + 1 / 4) * self.cell_width
-        self.tile_height = max(self.grid_size) * self.cell_height
-        self.canvas = tk.Canvas(self, width=(self.tile_width + self.cell_width) * len(self.devices) + self.cell_width,
-                                height=self.tile_height * 1.5, borderwidth=0, highlightthickness=0, bg="#FFFFFF")
+        self.layout = HexGridLayout(grid_size, len(devices))
+        self.topology = self.layout.topology
+        self.cell_circumradius = self.layout.cell_circumradius
+        self.cell_inradius = self.layout.cell_inradius
+        self.cell_width = self.layout.cell_width
+        self.cell_height = self.layout.cell_height
+        self.tile_width = self.layout.tile_width
+        self.tile_height = self.layout.tile_height
+        self.canvas = tk.Canvas(self, width=self.layout.width, height=self.layout.height, borderwidth=0,
+                                highlightthickness=0, bg="#FFFFFF")
 
         # Write MAC addresses under respective tiles.
         for i, device_name in enumerate(self.devices):
@@ -58,32 +62,38 @@ class HexGridPlot(tk.Tk):
 
         self.delay = 1  # Delay between redrawing in ms
 
+        # Values of a device form one flat frame in the order of the data, cell i is at (cell_rows[i], cell_columns[i])
+        self.cell_rows = self.layout.cell_rows
+        self.cell_columns = self.layout.cell_columns
         self.hex_values = {}
         self.hex_colors = {}
+        self.text_colors = {}
         for device in self.devices:
-            self.hex_values[device] = [[0 for _ in range(column_len)]
-                                       for column_len in self.grid_size]
-            self.hex_colors[device] = [[[0 for _ in range(3)] for _ in range(column_len)]
-                                       for column_len in self.grid_size]
+            self.hex_values[device] = np.zeros(self.topology.num_cells, dtype=np.uint8)
+            self.update_grid_colors_from_values(device)
 
         # Create individual squares
         self.hexagon_ids = {}
-        self.hexagon_centrepoints = {}
+        self.cell_centrepoints = {}
         self.text_ids = {}
         self._create_hexagons()
 
+        # Last fills and texts sent to Tk per device, so that redraw only configures the cells that changed
+        self.drawn_fills = {}
+        self.drawn_texts = {}
+
     def _create_hexagons(self):
         for device_num, device in enumerate(self.devices):
-            for column, column_len in enumerate(self.grid_size):
-                for row in range(column_len):
-                    x_centre = 1 / 2 * self.cell_width + self.cell_width + 3 / 4 * column * self.cell_width + \
-                               device_num * (self.tile_width + self.cell_width)
-                    y_centre = self.cell_height + (row + 1) * self.cell_height - (column_len % 2) * self.cell_height / 2
-                    self.hexagon_centrepoints[device, row, column] = (x_centre, y_centre)
-                    self.hexagon_ids[device, row, column] = self._create_hexagon_from_centrepoint(x_centre, y_centre)
-                    if self.disp_vals:
-                        self.text_ids[device, row, column] = self.canvas.create_text(x_centre, y_centre, fill="#ededed",
-                                                                                     font="Arial 20 bold", text='rgb')
+            self.cell_centrepoints[device] = self.layout.cell_centrepoints(device_num)
+            hexagon_ids = []
+            text_ids = []
+            for x_centre, y_centre in self.cell_centrepoints[device]:
+                hexagon_ids.append(self._create_hexagon_from_centrepoint(x_centre, y_centre))
+                if self.disp_vals:
+                    text_ids.append(self.canvas.create_text(x_centre, y_centre, fill="#ededed", font="Arial 20 bold",
+                                                            text='rgb'))
+            self.hexagon_ids[device] = hexagon_ids
+            self.text_ids[device] = text_ids
 
     def _create_hexagon_from_centrepoint(self, x_center, y_center):
         angle = np.pi / 3
@@ -110,27 +120,31 @@ class HexGridPlot(tk.Tk):
         # try:
         for device in self.devices:
             self.update_grid_colors_from_values(device)
-            for column, column_len in enumerate(self.grid_size):
-                for row in range(column_len):
-                    item_id_hex = self.hexagon_ids[device, row, column]
-                    value = self.hex_values[device][column][row]
-                    rgb = self.hex_colors[device][column][row]
-                    self.canvas.itemconfig(item_id_hex, fill="#%02x%02x%02x" % tuple(rgb))
-                    if self.disp_vals:
-                        item_id_text = self.text_ids[device, row, column]
-                        hsv = mpl.colors.rgb_to_hsv(rgb)
-                        if hsv[2] < 150:
-                            self.canvas.itemconfig(item_id_text, text=str(value), fill="#ededed")
-                        else:
-                            self.canvas.itemconfig(item_id_text, text=str(value), fill="#212121")
+            values = np.array(self.hex_values[device])
+            fills = self.hex_colors[device]
+            drawn_fills = self.drawn_fills.get(device)
+            changed = range(len(fills)) if drawn_fills is None else np.flatnonzero(fills != drawn_fills)
+            for cell in changed:
+                self.canvas.itemconfig(self.hexagon_ids[device][cell], fill=fills[cell])
+            self.drawn_fills[device] = fills
+            if self.disp_vals:
+                text_colors = self.text_colors[device]
+                drawn_values, drawn_text_colors = self.drawn_texts.get(device, (None, None))
+                changed = range(len(values)) if drawn_values is None else \
+                    np.flatnonzero((values != drawn_values) | (text_colors != drawn_text_colors))
+                for cell in changed:
+                    self.canvas.itemconfig(self.text_ids[device][cell], text=str(values[cell]), fill=text_colors[cell])
+                self.drawn_texts[device] = (values, text_colors)
         # except Exception as e:  # TODO: handle properly
         #    logger.error(f'Redraw failed: {e}')
 
     def update_grid_colors_from_values(self, device):
-        data_rgb = [[color_fader_rgb255(self.c1, self.c2, mix=self.hex_values[device][column][row] / 255) for row in
-                     range(column_len)]
-                    for column, column_len in enumerate(self.grid_size)]
-        self.hex_colors[device] = data_rgb
+        """
+        Looks up the fill and text colour strings of every cell, values are clipped to 8 bit
+        """
+        lut_idx = np.clip(np.asarray(self.hex_values[device], dtype=int), 0, 255)
+        self.hex_colors[device] = self.fill_lut[lut_idx]
+        self.text_colors[device] = self.text_color_lut[lut_idx]
 
     def update_view(self):
         self.redraw()
@@ -1,7 +1,8 @@
 import tkinter
 import numpy as np
 
-from visualisation.view.hex_grid_plot import HexGridPlot
+from sensor_comm.visualisation.view.hex_grid_plot import HexGridPlot
+from sensor_comm.utils.profiling import profiled
 
 
 class IRTouch32View(HexGridPlot):
@@ -19,7 +20,7 @@ class IRTouch32View(HexGridPlot):
             return edge_marker
 
         self.edge_marker_width = 10
-        self.num_edge_markers_per_device = 3 * 12 + 3 * 11  # TODO: derive from grid_size
+        self.num_edge_markers_per_device = self.topology.marker_capacity
         self.edge_markers = {device: [edge_marker() for _ in range(self.num_edge_markers_per_device)] for device in
                              devices}  # edge marker items are preallocated and made visible/positioned as needed
         self.edge_marker_centrepoints = {device: [] for device in devices}
@@ -41,45 +42,67 @@ class IRTouch32View(HexGridPlot):
                                             self.darkness_centrepoint_width, self.darkness_centrepoint_width,
                                             fill="#6595BF") for device in devices}
 
+        # Last state sent to Tk per device, so that redraw only touches the items that changed
+        self.drawn_darkness_centrepoints = {device: () for device in devices}
+        self.drawn_edge_marker_centrepoints = {device: [] for device in devices}
+        self.drawn_edges = {device: None for device in devices}
+        self.drawn_corner_edges = {device: None for device in devices}
+
         self.redraw()
 
+    @profiled('redraw')
     def redraw(self):
         for device in self.devices:
             # Darkness centrepoint
             darkness_centrepoint = self.darkness_centrepoint_indicators[device]
+            drawn_darkness_centrepoint = self.drawn_darkness_centrepoints[device]
             if self.darkness_centrepoints[device]:
-                self.canvas.moveto(darkness_centrepoint,
-                                   x=self.darkness_centrepoints[device][0] - self.darkness_centrepoint_width / 2,
-                                   y=self.darkness_centrepoints[device][1] - self.darkness_centrepoint_width / 2)
-                self.canvas.itemconfig(darkness_centrepoint, state=tkinter.NORMAL)
-            else:
+                if tuple(self.darkness_centrepoints[device]) != drawn_darkness_centrepoint:
+                    self.canvas.moveto(darkness_centrepoint,
+                                       x=self.darkness_centrepoints[device][0] - self.darkness_centrepoint_width / 2,
+                                       y=self.darkness_centrepoints[device][1] - self.darkness_centrepoint_width / 2)
+                    if drawn_darkness_centrepoint is None:
+                        self.canvas.itemconfig(darkness_centrepoint, state=tkinter.NORMAL)
+                    self.drawn_darkness_centrepoints[device] = tuple(self.darkness_centrepoints[device])
+            elif drawn_darkness_centrepoint is not None:
                 self.canvas.itemconfig(darkness_centrepoint, state=tkinter.HIDDEN)
+                self.drawn_darkness_centrepoints[device] = None
 
-            # Edge markers
-            for marker in self.edge_markers[device]:
-                self.canvas.itemconfig(marker, state=tkinter.HIDDEN)
-            for i, edge_marker_coords in enumerate(self.edge_marker_centrepoints[device]):
+            # Edge markers, only the markers that moved, appeared or disappeared are touched
+            drawn_coords = self.drawn_edge_marker_centrepoints[device]
+            coords = [tuple(edge_marker_coords) for edge_marker_coords in self.edge_marker_centrepoints[device]]
+            for i, edge_marker_coords in enumerate(coords):
                 edge_marker = self.edge_markers[device][i]
-                self.canvas.itemconfig(edge_marker, state=tkinter.NORMAL)
+                if i >= len(drawn_coords):
+                    self.canvas.itemconfig(edge_marker, state=tkinter.NORMAL)
+                elif edge_marker_coords == drawn_coords[i]:
+                    continue
                 self.canvas.moveto(edge_marker, edge_marker_coords[0] - self.edge_marker_width / 2,
                                    edge_marker_coords[1] - self.edge_marker_width / 2)
+            for edge_marker in self.edge_markers[device][len(coords):len(drawn_coords)]:
+                self.canvas.itemconfig(edge_marker, state=tkinter.HIDDEN)
+            self.drawn_edge_marker_centrepoints[device] = coords
 
             # Straight edges
             edge = self.edges[device]
-            x0, y0, angle = self.edges_params[device]
-            self.canvas.coords(edge, x0 - self.edge_len * np.cos(angle * np.pi / 180) / 2,
-                               y0 - self.edge_len * np.sin(angle * np.pi / 180) / 2,
-                               x0 + self.edge_len * np.cos(angle * np.pi / 180) / 2,
-                               y0 + self.edge_len * np.sin(angle * np.pi / 180) / 2)
+            if tuple(self.edges_params[device]) != self.drawn_edges[device]:
+                x0, y0, angle = self.edges_params[device]
+                self.canvas.coords(edge, x0 - self.edge_len * np.cos(angle * np.pi / 180) / 2,
+                                   y0 - self.edge_len * np.sin(angle * np.pi / 180) / 2,
+                                   x0 + self.edge_len * np.cos(angle * np.pi / 180) / 2,
+                                   y0 + self.edge_len * np.sin(angle * np.pi / 180) / 2)
+                self.drawn_edges[device] = tuple(self.edges_params[device])
 
             # Corner edges
-            edge_len = 300
-            line1 = self.corner_edges[device][0]
-            line2 = self.corner_edges[device][1]
-            x0, y0, angle1, angle2 = self.corner_params[device]
-            self.canvas.coords(line1, x0, y0, x0 + edge_len * np.cos(angle1 * np.pi / 180),
-                               y0 + edge_len * np.sin(angle1 * np.pi / 180))
-            self.canvas.coords(line2, x0, y0, x0 + edge_len * np.cos(angle2 * np.pi / 180),
-                               y0 + edge_len * np.sin(angle2 * np.pi / 180))
+            if tuple(self.corner_params[device]) != self.drawn_corner_edges[device]:
+                edge_len = 300
+                line1 = self.corner_edges[device][0]
+                line2 = self.corner_edges[device][1]
+                x0, y0, angle1, angle2 = self.corner_params[device]
+                self.canvas.coords(line1, x0, y0, x0 + edge_len * np.cos(angle1 * np.pi / 180),
+                                   y0 + edge_len * np.sin(angle1 * np.pi / 180))
+                self.canvas.coords(line2, x0, y0, x0 + edge_len * np.cos(angle2 * np.pi / 180),
+                                   y0 + edge_len * np.sin(angle2 * np.pi / 180))
+                self.drawn_corner_edges[device] = tuple(self.corner_params[device])
 
         super(IRTouch32View, self).redraw()
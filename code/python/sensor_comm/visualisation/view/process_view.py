@@ -0,0 +1,151 @@
+import atexit
+import time
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from loguru import logger
+
+from sensor_comm.utils.general import spawn_context
+from sensor_comm.utils.hex_grid import HexGridTopology
+from sensor_comm.visualisation.view.headless_view import HeadlessIRTouch32View
+
+
+def shared_view_dtype(num_devices, grid_size):
+    """
+    Layout of the shared memory block through which ProcessIRTouch32View hands its state to the view process. The
+    sequence number is a seqlock: it is odd while the state is being written.
+    """
+    topology = HexGridTopology.get(grid_size)
+    num_cells = topology.num_cells
+    max_edge_markers = topology.marker_capacity
+    return np.dtype([('sequence', '<u8'),
+                     ('stop', 'u1'),
+                     ('hex_values', '<f8', (num_devices, num_cells)),
+                     ('num_edge_markers', '<i4', (num_devices,)),
+                     ('edge_marker_centrepoints', '<f8', (num_devices, max_edge_markers, 2)),
+                     ('edges_params', '<f8', (num_devices, 3)),
+                     ('corner_params', '<f8', (num_devices, 4)),
+                     ('darkness_visible', 'u1', (num_devices,)),
+                     ('darkness_centrepoints', '<f8', (num_devices, 2))])
+
+
+def read_shared_state(state, attempts=10):
+    """
+    :param state: 0-d structured array on the shared memory block
+    :return: a consistent copy of the state, or None if the writer kept changing it
+    """
+    for _ in range(attempts):
+        sequence = int(state['sequence'])
+        if sequence % 2 == 0:
+            snapshot = state.copy()
+            if int(state['sequence']) == sequence:
+                return snapshot
+        time.sleep(0)
+    return None
+
+
+def run_view_process(shared_memory_name, devices, grid_size, disp_vals, redraw_delay):
+    """
+    Entry point of the view process: draws the state found in shared memory in an IRTouch32View, until the stop flag
+    is set or the window is closed.
+    """
+    import tkinter
+    from sensor_comm.visualisation.view.irtouch32_view import IRTouch32View
+
+    shared_memory = SharedMemory(name=shared_memory_name)
+    state = np.ndarray((), dtype=shared_view_dtype(len(devices), grid_size), buffer=shared_memory.buf)
+    last_sequence = None
+    try:
+        view = IRTouch32View(devices=devices, grid_size=grid_size, disp_vals=disp_vals)
+        while not state['stop']:
+            snapshot = read_shared_state(state)
+            if snapshot is not None and snapshot['sequence'] != last_sequence:
+                last_sequence = snapshot['sequence']
+                for device_idx, device in enumerate(devices):
+                    view.hex_values[device] = np.rint(snapshot['hex_values'][device_idx]).astype(int)
+                    num_edge_markers = snapshot['num_edge_markers'][device_idx]
+                    view.edge_marker_centrepoints[device] = \
+                        snapshot['edge_marker_centrepoints'][device_idx, :num_edge_markers]
+                    view.edges_params[device] = tuple(snapshot['edges_params'][device_idx])
+                    view.corner_params[device] = tuple(snapshot['corner_params'][device_idx])
+                    view.darkness_centrepoints[device] = tuple(snapshot['darkness_centrepoints'][device_idx]) \
+                        if snapshot['darkness_visible'][device_idx] else None
+                view.update_view()
+            else:
+                view.update()
+            time.sleep(redraw_delay)
+    except tkinter.TclError as e:
+        logger.warning(f"View process stopped: {e}")
+    finally:
+        del state
+        shared_memory.close()
+
+
+class ProcessIRTouch32View(HeadlessIRTouch32View):
+    """
+    IRTouch32View running in a separate process, so drawing never delays the handling of notifications. The viewmodel
+    writes to this object as it would to an IRTouch32View, update_view copies that state into a shared memory block
+    without waiting for the view process, which draws the most recent complete state it finds there. If the window is
+    closed, or the view process hangs, data capture carries on.
+    """
+    headless = False  # update_view must still be called periodically, to publish the state
+
+    def __init__(self, devices=None, grid_size=(5, 4, 5, 4, 5, 4, 5), disp_vals=True, redraw_delay=0.01):
+        """
+        :param redraw_delay: time in s the view process waits between two redraws
+        """
+        super().__init__(devices=devices, grid_size=grid_size)
+        dtype = shared_view_dtype(len(devices), grid_size)
+        self.shared_memory = SharedMemory(create=True, size=dtype.itemsize)
+        self.state = np.ndarray((), dtype=dtype, buffer=self.shared_memory.buf)
+        self.state.fill(0)
+        self.max_edge_markers = dtype['edge_marker_centrepoints'].shape[1]
+
+        context = spawn_context()
+        self.process = context.Process(target=run_view_process, name="IRTouch32View", daemon=True,
+                                       args=(self.shared_memory.name, devices, grid_size, disp_vals, redraw_delay))
+        self.process.start()
+        self.process_lost = False
+        atexit.register(self.close)
+
+    def update_view(self):
+        """
+        Publishes the current state to the view process
+        """
+        if not self.process.is_alive():
+            if not self.process_lost:
+                logger.warning("View process is no longer running, data capture continues without it")
+                self.process_lost = True
+            return
+        state = self.state
+        state['sequence'] += 1
+        for device_idx, device in enumerate(self.devices):
+            state['hex_values'][device_idx] = self.hex_values[device]
+            edge_marker_centrepoints = np.asarray(self.edge_marker_centrepoints[device]).reshape(-1, 2)
+            num_edge_markers = min(len(edge_marker_centrepoints), self.max_edge_markers)
+            state['num_edge_markers'][device_idx] = num_edge_markers
+            state['edge_marker_centrepoints'][device_idx, :num_edge_markers] = \
+                edge_marker_centrepoints[:num_edge_markers]
+            state['edges_params'][device_idx] = self.edges_params[device]
+            state['corner_params'][device_idx] = self.corner_params[device]
+            darkness_centrepoint = self.darkness_centrepoints[device]
+            state['darkness_visible'][device_idx] = darkness_centrepoint is not None
+            if darkness_centrepoint is not None:
+                state['darkness_centrepoints'][device_idx] = darkness_centrepoint
+        state['sequence'] += 1
+
+    def close(self, timeout=1.0):
+        """
+        Stops the view process and releases the shared memory
+        """
+        if self.state is None:
+            return
+        self.state['stop'] = 1
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.state = None
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    def destroy(self):
+        self.close()
@@ -4,21 +4,19 @@ import numpy as np
 import scipy.optimize as scipy_opt
 from loguru import logger
 
+from sensor_comm.utils.hex_grid import HexGridTopology, edge_marker_coords
+
 
 class IRTouch32ViewModel:
     def __init__(self, view):
         self.view = view
         self.grid_size = self.view.grid_size
-        self.num_pts = 0
-        for column_len in self.grid_size:
-            self.num_pts += column_len
+        self.topology = HexGridTopology.get(self.grid_size)
+        self.num_pts = self.topology.num_cells
         self.calibration_data = [255 for _ in range(self.num_pts)]
         self.devices = self.view.devices
         self.current_data = {device: [0 for _ in range(self.num_pts)] for device in self.devices}
-        self.calibrated_data = {device: [0 for _ in range(self.num_pts)] for device in self.devices}
-        self.formatted_data = {}
-        for device in self.devices:
-            self.formatted_data[device] = [[0 for _ in range(column_len)] for column_len in self.grid_size]
+        self.calibrated_data = {device: np.zeros(self.num_pts, dtype=int) for device in self.devices}
         self.grid_values_mean = None
 
         self.update_edge_detection_complete = asyncio.Event()
@@ -27,13 +25,21 @@ class IRTouch32ViewModel:
         self.darkness_threshold = -1
         self.num_edge_markers = 0
 
+        # Neighbour pairs and the vectors between their centrepoints don't change, so they are computed only once
+        self.edge_pair_origins = {}
+        self.edge_pair_vectors = {}
+        for device in self.devices:
+            centrepoints = self.view.cell_centrepoints[device]
+            self.edge_pair_origins[device] = centrepoints[self.topology.edge_pairs_first]
+            self.edge_pair_vectors[device] = centrepoints[self.topology.edge_pairs_second] - \
+                self.edge_pair_origins[device]
+
         self.edge_fit_errors = {device: 0 for device in self.devices}
 
     def update_device_data(self, device, data):
         self.current_data[device] = data
         self.calibrate_data(device)
-        self.format_data(device)
-        self.view.hex_values[device] = self.formatted_data[device]
+        self.view.hex_values[device] = self.calibrated_data[device]
         if self.update_edge_detection_complete.is_set():
             self.update_edge_detection_complete.clear()
             asyncio.create_task(self.update_edge_detection(device))
@@ -67,123 +73,27 @@ class IRTouch32ViewModel:
         if self.darkness_threshold == -1:
             self.view.darkness_centrepoints[device] = None
             return
-        x_centrepoint = 0
-        y_centrepoint = 0
-        num_dark_hexagons = 0
-        normalisation = 0
-        for column, column_len in enumerate(self.grid_size):
-            for row in range(column_len):
-                value = self.formatted_data[device][column][row]
-                if value < self.darkness_threshold:
-                    num_dark_hexagons += 1
-                    weight = (255 - value)
-                    normalisation += weight
-                    hexagon_centrepoint = self.view.hexagon_centrepoints[device, row, column]
-                    x_centrepoint += weight * hexagon_centrepoint[0]
-                    y_centrepoint += weight * hexagon_centrepoint[1]
+        values = self.calibrated_data[device]
+        dark = values < self.darkness_threshold
+        weights = 255 - values[dark]
+        normalisation = weights.sum()
         if not normalisation:
             return
-        x_centrepoint /= normalisation
-        y_centrepoint /= normalisation
+        x_centrepoint, y_centrepoint = weights @ self.view.cell_centrepoints[device][dark] / normalisation
         self.view.darkness_centrepoints[device] = (x_centrepoint, y_centrepoint)
 
     def update_edge_markers(self, device):
-        """
-        TODO: prettify (as-is the code does avoid if-statements in loops, improving performance, but bulking up the code)
-        """
-        self.view.edge_marker_centrepoints[device] = []
-        self.num_edge_markers = 0
         if self.darkness_threshold == -1:
+            self.view.edge_marker_centrepoints[device] = np.empty((0, 2))
+            self.num_edge_markers = 0
             return
-        for column, column_len in enumerate(self.grid_size[:-1]):
-            next_column_len = self.grid_size[column + 1]
-            if column_len > next_column_len:
-                value_centre = self.formatted_data[device][column][0]
-                value_right_down = self.formatted_data[device][column + 1][0]
-                value_down = self.formatted_data[device][column][1]
-
-                centrepoint_centre = self.view.hexagon_centrepoints[device, 0, column]
-                centrepoint_right_down = self.view.hexagon_centrepoints[device, 0, column + 1]
-                centrepoint_down = self.view.hexagon_centrepoints[device, 1, column]
-
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_down, value_centre,
-                                                     value_right_down)
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_down, value_centre,
-                                                     value_down)
-                for row in range(1, column_len - 1):
-                    value_centre = self.formatted_data[device][column][row]
-                    value_right_down = self.formatted_data[device][column + 1][row]
-                    value_right_up = self.formatted_data[device][column + 1][row - 1]
-                    value_down = self.formatted_data[device][column][row + 1]
-
-                    centrepoint_centre = self.view.hexagon_centrepoints[device, row, column]
-                    centrepoint_right_down = self.view.hexagon_centrepoints[device, row, column + 1]
-                    centrepoint_right_up = self.view.hexagon_centrepoints[device, row - 1, column + 1]
-                    centrepoint_down = self.view.hexagon_centrepoints[device, row + 1, column]
-
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_up, value_centre,
-                                                         value_right_up)
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_down,
-                                                         value_centre, value_right_down)
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_down, value_centre,
-                                                         value_down)
-
-                value_centre = self.formatted_data[device][column][-1]
-                value_right_up = self.formatted_data[device][column + 1][-1]
-
-                centrepoint_centre = self.view.hexagon_centrepoints[device, column_len - 1, column]
-                centrepoint_right_up = self.view.hexagon_centrepoints[device, column_len - 2, column + 1]
-
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_up, value_centre,
-                                                     value_right_up)
-            if column_len < next_column_len:
-                for row in range(column_len - 1):
-                    value_centre = self.formatted_data[device][column][row]
-                    value_right_up = self.formatted_data[device][column + 1][row]
-                    value_right_down = self.formatted_data[device][column + 1][row + 1]
-                    value_down = self.formatted_data[device][column][row + 1]
-
-                    centrepoint_centre = self.view.hexagon_centrepoints[device, row, column]
-                    centrepoint_right_up = self.view.hexagon_centrepoints[device, row, column + 1]
-                    centrepoint_right_down = self.view.hexagon_centrepoints[device, row + 1, column + 1]
-                    centrepoint_down = self.view.hexagon_centrepoints[device, row + 1, column]
-
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_up, value_centre,
-                                                         value_right_up)
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_down,
-                                                         value_centre,
-                                                         value_right_down)
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_down, value_centre,
-                                                         value_down)
-                value_centre = self.formatted_data[device][column][column_len - 1]
-                value_right_up = self.formatted_data[device][column + 1][column_len - 1]
-                value_right_down = self.formatted_data[device][column + 1][column_len]
-
-                centrepoint_centre = self.view.hexagon_centrepoints[device, column_len - 1, column]
-                centrepoint_right_up = self.view.hexagon_centrepoints[device, column_len - 1, column + 1]
-                centrepoint_right_down = self.view.hexagon_centrepoints[device, column_len, column + 1]
-
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_up, value_centre,
-                                                     value_right_up)
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_down, value_centre,
-                                                     value_right_down)
-            else:
-                Exception("Unexpected hexagonal grid definition: adjacent columns of equal size")
-        return
-
-    def evaluate_edge_and_create_marker(self, device, centrepoint1, centrepoint2, value1, value2):
-        centrepoint1 = np.array(centrepoint1)
-        centrepoint2 = np.array(centrepoint2)
-        if min(value1, value2) <= self.darkness_threshold < max(value1, value2):
-            # indicates an edge between the two centrepoints
-            value_difference = value2 - value1
-            direction_vector = centrepoint2 - centrepoint1
-            distance = np.linalg.norm(direction_vector)
-            direction_vector /= distance
-            edge_marker_coords = centrepoint1 + direction_vector * distance * (
-                    self.darkness_threshold - value1) / value_difference
-            self.view.edge_marker_centrepoints[device].append(edge_marker_coords)
-            self.num_edge_markers += 1
+        self.view.edge_marker_centrepoints[device] = edge_marker_coords(self.calibrated_data[device],
+                                                                        self.darkness_threshold,
+                                                                        self.topology.edge_pairs_first,
+                                                                        self.topology.edge_pairs_second,
+                                                                        self.edge_pair_origins[device],
+                                                                        self.edge_pair_vectors[device])
+        self.num_edge_markers = len(self.view.edge_marker_centrepoints[device])
 
     def edge_fitting_function(self, xy, x0, y0, angle):
         p0 = np.array([x0, y0])
@@ -216,14 +126,3 @@ class IRTouch32ViewModel:
         data = self.current_data[device]
         self.calibrated_data[device] = np.rint(np.array(data) / np.array(self.calibration_data) * 255).astype(int)
         self.calibrated_data[device][self.calibrated_data[device] > 255] = 255
-
-    def format_data(self, device):
-        """
-        Data is a list of 32 values, with the list index of a value corresponding to the grid index as defined in the
-        __init__ of HexGridPlot.
-        """
-        ctr = 0
-        for column, column_len in enumerate(self.grid_size):
-            for row in range(column_len):
-                self.formatted_data[device][column][row] = self.calibrated_data[device][ctr]
-                ctr += 1
@@ -1,228 +1,373 @@
 import asyncio
+import concurrent.futures
+import functools
+import os
 import time
 import numpy as np
-import scipy.optimize as scipy_opt
 from loguru import logger
 
+from sensor_comm.utils.calibration import Calibration
+from sensor_comm.utils.fit_cache import FitCache
+from sensor_comm.utils.general import spawn_context
+from sensor_comm.utils.hex_grid import HexGridTopology, edge_marker_coords_batch
+from sensor_comm.utils.line_fitting import fit_line_at_x, fit_corner
+from sensor_comm.utils.profiling import profiled
+from sensor_comm.utils.scheduling import LatestValueScheduler
+
+
+def fit_edge(xy_array, x0):
+    """
+    Straight edge fit through the edge markers of a device
+    :return: (edges_params, edge_fit_error), edges_params is (x0, y0, angle)
+    """
+    if xy_array.shape[0] < 2:
+        return (x0, 0, 0), 0  # no edge so no error
+    x0, y0, angle, error = fit_line_at_x(xy_array, x0)
+    return (x0, y0, angle), error
+
+
+def fit_edge_corner(xy_array, bounds):
+    """
+    Corner fit through the edge markers of a device
+    :return: (corner_params, corner_angle, corner_fit_error), corner_params is (x0, y0, angle1, angle2), the angle
+    and error are None if there are too few markers to fit
+    """
+    if xy_array.shape[0] < 2:
+        return (0, 0, 0, 0), None, None
+    parameters = fit_corner(xy_array, bounds=bounds)
+    angle = abs(parameters[3] - parameters[2])
+    while angle > 180:
+        angle -= 360
+    error = np.sqrt(np.mean(IRTouch32ViewModel.corner_fitting_function(xy_array, *parameters) ** 2))
+    return parameters, abs(angle), error
+
+
+def fit_edge_and_corner(xy_array, x0, bounds):
+    """
+    Both fits of a device at once, the job that is run by the fit executor of IRTouch32ViewModel
+    """
+    return fit_edge(xy_array, x0), fit_edge_corner(xy_array, bounds)
+
 
 class IRTouch32ViewModel:
-    def __init__(self, view):
+    def __init__(self, view, inline_analysis=False, calibration=None, fit_mode="INLINE", fit_workers=None,
+                 refit_frame_delta=0, refit_marker_delta=0.0, fit_cache_size=128, fit_cache_resolution=0.1):
+        """
+        :param view: IRTouch32View, or HeadlessIRTouch32View to run without a display
+        :param inline_analysis: run the edge detection on every incoming frame, from within update_device_data,
+        rather than in a separate asyncio task
+        :param calibration: calibration.Calibration of the devices, by default the values are not calibrated
+        :param fit_mode: "INLINE" to run the edge and corner fits on the event loop, "THREAD" or "PROCESS" to run them
+        in a pool of worker threads or processes, so the event loop carries on handling notifications meanwhile
+        :param fit_workers: size of that pool, by default one worker per device, up to the number of CPUs
+        :param refit_frame_delta: the fits of a device are skipped if no calibrated value changed by more than this
+        since its last fit...
+        :param refit_marker_delta: ...and no edge marker moved by more than this (in pixels), by default the fits are
+        only skipped for identical frames
+        :param fit_cache_size: number of fit results kept in an LRU cache keyed on the edge markers, 0 to disable it
+        :param fit_cache_resolution: edge markers (in pixels) are quantised to this step for the cache lookup
+        """
         self.view = view
         self.grid_size = self.view.grid_size
-        self.num_pts = 0
-        for column_len in self.grid_size:
-            self.num_pts += column_len
-        self.calibration_data = [255 for _ in range(self.num_pts)]
+        self.topology = HexGridTopology.get(self.grid_size)
+        self.num_pts = self.topology.num_cells
+        self.calibration = calibration if calibration else Calibration(self.num_pts)
         self.devices = self.view.devices
-        self.current_data = {device: [0 for _ in range(self.num_pts)] for device in self.devices}
-        self.calibrated_data = {device: [0 for _ in range(self.num_pts)] for device in self.devices}
-        self.formatted_data = {}
-        for device in self.devices:
-            self.formatted_data[device] = [[0 for _ in range(column_len)] for column_len in self.grid_size]
-        self.grid_values_mean = None
-
-        self.update_edge_detection_complete = asyncio.Event()
-        self.last_time_since_edge_detection = 0
-        self.update_edge_detection_complete.set()
-        self.darkness_threshold = -1
-        self.num_edge_markers = 0
+        # Frames are flat uint8 arrays in the order of the data, shared with the view as they are
+        self.current_data = {device: np.zeros(self.num_pts, dtype=np.uint8) for device in self.devices}
+        self.calibrated_data = {device: np.zeros(self.num_pts, dtype=np.uint8) for device in self.devices}
+        self.device_indices = {device: device_idx for device_idx, device in enumerate(self.devices)}
+        self.grid_values_means = {device: None for device in self.devices}
+
+        # Devices with a frame that hasn't been analysed yet are analysed together, newest frame only, as soon as
+        # the previous analysis is done
+        self.analysis_scheduler = LatestValueScheduler(self.update_edge_detection, keys=self.devices)
+        self.darkness_thresholds = {device: -1 for device in self.devices}
+        self.num_edge_markers = {device: 0 for device in self.devices}
+
+        # Neighbour pairs and the vectors between their centrepoints don't change, so they are computed only once,
+        # stacked over the devices
+        self.edge_pairs_first = self.topology.edge_pairs_first
+        self.edge_pairs_second = self.topology.edge_pairs_second
+        self.cell_centrepoints = np.stack([self.view.cell_centrepoints[device] for device in self.devices])
+        self.edge_pair_origins = self.cell_centrepoints[:, self.edge_pairs_first]
+        self.edge_pair_vectors = self.cell_centrepoints[:, self.edge_pairs_second] - self.edge_pair_origins
 
         self.edge_fit_errors = {device: 0 for device in self.devices}
         self.corner_fit_angles = {device: 0 for device in self.devices}
-        self.init_corner_fit = {
-            device: [self.view.cell_width + self.view.tile_width / 2 + device_idx * (
-                        self.view.cell_width + self.view.tile_width),
-                     self.view.cell_height + self.view.tile_height / 2,
-                     180, 270] for device_idx, device in enumerate(self.devices)}
-        self.prev_corner_fit = {device: self.init_corner_fit[device].copy() for device in self.devices}
+
+        self.inline_analysis = inline_analysis
+        self.analysis_listeners = []
+
+        # At most one fit per device is in flight in the fit executor. The markers of a newer frame wait in next_fits,
+        # where a yet newer frame replaces them, so fits that are already stale are never started.
+        if fit_workers is None:
+            fit_workers = max(1, min(len(self.devices), os.cpu_count() or 1))
+        if fit_mode == "INLINE":
+            self.fit_executor = None
+        elif fit_mode == "THREAD":
+            self.fit_executor = concurrent.futures.ThreadPoolExecutor(max_workers=fit_workers,
+                                                                      thread_name_prefix="IRTouch32 fit")
+        elif fit_mode == "PROCESS":
+            self.fit_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=fit_workers, mp_context=spawn_context())
+        else:
+            raise ValueError("Invalid fit mode passed")
+        self.fit_generations = {device: 0 for device in self.devices}
+        self.published_fit_generations = {device: 0 for device in self.devices}
+        self.fit_futures = {device: None for device in self.devices}
+        self.next_fits = {device: None for device in self.devices}
+        self.stale_fits = {device: 0 for device in self.devices}
+
+        # Change detection and memoisation of the fits
+        self.refit_frame_delta = refit_frame_delta
+        self.refit_marker_delta = refit_marker_delta
+        self.last_fit_frames = {device: None for device in self.devices}
+        self.last_fit_markers = {device: None for device in self.devices}
+        self.fit_cache = FitCache(max_size=fit_cache_size, resolution=fit_cache_resolution)
+        self.skipped_fits = {device: 0 for device in self.devices}
+        self.cached_fits = {device: 0 for device in self.devices}
 
     def update_device_data(self, device, data):
         self.current_data[device] = data
         self.calibrate_data(device)
-        self.format_data(device)
-        self.view.hex_values[device] = self.formatted_data[device]
-        if self.update_edge_detection_complete.is_set():
-            self.update_edge_detection_complete.clear()
-            asyncio.create_task(self.update_edge_detection(device))
+        self.view.hex_values[device] = self.calibrated_data[device]
+        if self.inline_analysis:
+            self.analyse(device)
+            return
+        self.analysis_scheduler.submit(device)
 
     def update_view(self):
         self.view.update_view()
 
-    async def update_edge_detection(self, device):
-        #self.update_darkness_threshold(device)
-        #self.update_darkness_centrepoint(device)
-        #self.update_edge_markers(device)
-        # self.update_corner_fit(device)
-        #self.update_edge_fit(device)
-        await asyncio.sleep(0.01)
-        #self.update_edge_detection_complete.set()
-        # t_now = time.time()
-        # logger.debug(f'Update freq: {1/(t_now - self.last_time_since_edge_detection)}')
-        # self.last_time_since_edge_detection = t_now
-
-    def update_darkness_threshold(self, device):
-        data_sorted = np.array(sorted(self.calibrated_data[device]))
-        self.grid_values_mean = np.mean(data_sorted)
-        data_sorted_low = data_sorted[:-1]
-        data_sorted_high = data_sorted[1:]
-        data_diff = abs(data_sorted_high - data_sorted_low)
-        cutoff_idx = np.argmax(data_diff)
-        cluster_dark_mean = np.mean(data_sorted[:cutoff_idx + 1])
-        cluster_bright_mean = np.mean(data_sorted[cutoff_idx + 1:])
-        if abs(cluster_dark_mean - cluster_bright_mean) < 80:
-            self.darkness_threshold = -1
+    def add_analysis_listener(self, listener):
+        """
+        :param listener: function called with the device as argument, every time analyse has run for that device
+        """
+        self.analysis_listeners.append(listener)
+
+    def analyse(self, device):
+        """
+        Runs all edge detection stages on the current data of a device and notifies the analysis listeners
+        """
+        self.analyse_devices([device])
+
+    @profiled('analyse')
+    def analyse_devices(self, devices):
+        """
+        Runs all edge detection stages on the current data of several devices and notifies the analysis listeners.
+        The threshold, centrepoint and edge marker stages process the frames of all devices in one vectorised pass.
+        """
+        device_indices = [self.device_indices[device] for device in devices]
+        frames = np.stack([self.calibrated_data[device] for device in devices])
+        thresholds = self.update_darkness_thresholds(devices, frames)
+        self.update_darkness_centrepoints(devices, device_indices, frames, thresholds)
+        self.update_edge_markers(devices, device_indices, frames, thresholds)
+        for device in devices:
+            if self.fit(device):
+                self.notify_analysis_listeners(device)
+
+    def notify_analysis_listeners(self, device):
+        for listener in self.analysis_listeners:
+            listener(device)
+
+    def fit(self, device):
+        """
+        Brings the edge and corner fits of a device up to date with its current edge markers. The fits are skipped if
+        neither the frame nor the markers changed by more than the refit deltas since the last fit, taken from the
+        fit cache if (nearly) the same markers were fitted before, and computed otherwise, inline or in the fit
+        executor.
+        :return: True if the results are up to date, False if they will be published once the fit executor is done
+        """
+        frame = self.calibrated_data[device]
+        xy_array = np.array(self.view.edge_marker_centrepoints[device])
+        if self.fit_unchanged(device, frame, xy_array):
+            self.skipped_fits[device] += 1
+            return self.fit_futures[device] is None and self.next_fits[device] is None
+        self.last_fit_frames[device] = frame
+        self.last_fit_markers[device] = xy_array
+        key = self.fit_cache.key(device, xy_array)
+        cached_fits = self.fit_cache.get(key)
+        if cached_fits is not None:
+            self.cached_fits[device] += 1
+            self.fit_generations[device] += 1
+            if self.next_fits[device] is not None:
+                self.next_fits[device] = None
+                self.stale_fits[device] += 1
+            self.publish_fits(device, self.fit_generations[device], *cached_fits)
+            return True
+        if self.fit_executor is not None:
+            self.submit_fits(device, xy_array, key)
+            return False
+        self.fit_cache.put(key, (self.update_edge_fit(device), self.update_corner_fit(device)))
+        return True
+
+    def fit_unchanged(self, device, frame, xy_array):
+        """
+        :return: True if the frame and the edge markers of a device are within the refit deltas of those of its last
+        fit
+        """
+        last_frame = self.last_fit_frames[device]
+        last_markers = self.last_fit_markers[device]
+        if last_frame is None or last_markers.shape != xy_array.shape:
+            return False
+        if np.max(np.abs(frame.astype(np.int16) - last_frame)) > self.refit_frame_delta:
+            return False
+        return not len(xy_array) or np.max(np.abs(xy_array - last_markers)) <= self.refit_marker_delta
+
+    def publish_fits(self, device, generation, edge_fit, corner_fit):
+        self.publish_edge_fit(device, *edge_fit)
+        self.publish_corner_fit(device, *corner_fit)
+        self.published_fit_generations[device] = generation
+
+    def submit_fits(self, device, xy_array, key):
+        """
+        Hands the fits of the edge markers of a device to the fit executor, or, if a fit of that device is still in
+        flight, queues them to be started once it's done, replacing (and counting as stale) the markers that were
+        queued before
+        :param key: fit cache key of the markers, the results are cached under it
+        """
+        self.fit_generations[device] += 1
+        if self.next_fits[device] is not None:
+            self.stale_fits[device] += 1
+        self.next_fits[device] = (self.fit_generations[device], key, xy_array, self.edge_fit_x0(device),
+                                  self.corner_fit_bounds(device))
+        if self.fit_futures[device] is None:
+            self._start_next_fit(device)
+
+    def _start_next_fit(self, device):
+        generation, key, *fit_args = self.next_fits[device]
+        self.next_fits[device] = None
+        future = asyncio.get_running_loop().run_in_executor(self.fit_executor, fit_edge_and_corner, *fit_args)
+        future.add_done_callback(functools.partial(self._on_fit_done, device, generation, key))
+        self.fit_futures[device] = future
+
+    def _on_fit_done(self, device, generation, key, future):
+        """
+        Runs on the event loop, so the results of both fits are published at once, between two notifications
+        """
+        self.fit_futures[device] = None
+        if future.cancelled():
+            self.stale_fits[device] += 1
+        elif future.exception() is not None:
+            logger.error(f"Fitting the edge of {device} failed: {future.exception()!r}")
+        elif generation <= self.published_fit_generations[device]:
+            self.fit_cache.put(key, future.result())
+            self.stale_fits[device] += 1  # a fit of a newer frame was published already
         else:
-            self.darkness_threshold = (cluster_bright_mean + cluster_dark_mean) / 2
+            self.fit_cache.put(key, future.result())
+            self.publish_fits(device, generation, *future.result())
+            self.notify_analysis_listeners(device)
+        if self.next_fits[device] is not None and self.fit_executor is not None:
+            self._start_next_fit(device)
 
-    def update_darkness_centrepoint(self, device):
-        if self.darkness_threshold == -1:
-            self.view.darkness_centrepoints[device] = None
-            return
-        x_centrepoint = 0
-        y_centrepoint = 0
-        num_dark_hexagons = 0
-        normalisation = 0
-        for column, column_len in enumerate(self.grid_size):
-            for row in range(column_len):
-                value = self.formatted_data[device][column][row]
-                if value < self.darkness_threshold:
-                    num_dark_hexagons += 1
-                    weight = (255 - value)
-                    normalisation += weight
-                    hexagon_centrepoint = self.view.hexagon_centrepoints[device, row, column]
-                    x_centrepoint += weight * hexagon_centrepoint[0]
-                    y_centrepoint += weight * hexagon_centrepoint[1]
-        if not normalisation:
+    def close(self):
+        """
+        Cancels the fits in flight and shuts the fit executor down
+        """
+        self.analysis_scheduler.stop()
+        if self.fit_executor is None:
             return
-        x_centrepoint /= normalisation
-        y_centrepoint /= normalisation
-        self.view.darkness_centrepoints[device] = (x_centrepoint, y_centrepoint)
+        for device, future in self.fit_futures.items():
+            if future is not None:
+                future.cancel()
+            self.next_fits[device] = None
+        self.fit_executor.shutdown(wait=False, cancel_futures=True)
+        self.fit_executor = None
+
+    async def update_edge_detection(self, devices):
+        self.analyse_devices(devices)
 
-    def update_edge_markers(self, device):
+    def get_analysis_stats(self, device=None):
         """
-        TODO: prettify (as-is the code does avoid if-statements in loops, improving performance, but bulking up the code)
+        :return: dict with the number of frames of a device that were analysed, coalesced (replaced by a newer frame
+        before their analysis started) and dropped, and the number of fits in a fit executor that were skipped or
+        discarded because a newer frame had come in (stale_fits), skipped because nothing changed (skipped_fits) or
+        taken from the fit cache (cached_fits), or a dict device -> those counts if no device is given. With inline
+        analysis every frame is analysed and no frames are counted.
         """
-        self.view.edge_marker_centrepoints[device] = []
-        self.num_edge_markers = 0
-        if self.darkness_threshold == -1:
-            return
-        for column, column_len in enumerate(self.grid_size[:-1]):
-            next_column_len = self.grid_size[column + 1]
-            if column_len > next_column_len:
-                value_centre = self.formatted_data[device][column][0]
-                value_right_down = self.formatted_data[device][column + 1][0]
-                value_down = self.formatted_data[device][column][1]
-
-                centrepoint_centre = self.view.hexagon_centrepoints[device, 0, column]
-                centrepoint_right_down = self.view.hexagon_centrepoints[device, 0, column + 1]
-                centrepoint_down = self.view.hexagon_centrepoints[device, 1, column]
-
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_down, value_centre,
-                                                     value_right_down)
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_down, value_centre,
-                                                     value_down)
-                for row in range(1, column_len - 1):
-                    value_centre = self.formatted_data[device][column][row]
-                    value_right_down = self.formatted_data[device][column + 1][row]
-                    value_right_up = self.formatted_data[device][column + 1][row - 1]
-                    value_down = self.formatted_data[device][column][row + 1]
-
-                    centrepoint_centre = self.view.hexagon_centrepoints[device, row, column]
-                    centrepoint_right_down = self.view.hexagon_centrepoints[device, row, column + 1]
-                    centrepoint_right_up = self.view.hexagon_centrepoints[device, row - 1, column + 1]
-                    centrepoint_down = self.view.hexagon_centrepoints[device, row + 1, column]
-
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_up, value_centre,
-                                                         value_right_up)
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_down,
-                                                         value_centre, value_right_down)
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_down, value_centre,
-                                                         value_down)
-
-                value_centre = self.formatted_data[device][column][-1]
-                value_right_up = self.formatted_data[device][column + 1][-1]
-
-                centrepoint_centre = self.view.hexagon_centrepoints[device, column_len - 1, column]
-                centrepoint_right_up = self.view.hexagon_centrepoints[device, column_len - 2, column + 1]
-
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_up, value_centre,
-                                                     value_right_up)
-            if column_len < next_column_len:
-                for row in range(column_len - 1):
-                    value_centre = self.formatted_data[device][column][row]
-                    value_right_up = self.formatted_data[device][column + 1][row]
-                    value_right_down = self.formatted_data[device][column + 1][row + 1]
-                    value_down = self.formatted_data[device][column][row + 1]
-
-                    centrepoint_centre = self.view.hexagon_centrepoints[device, row, column]
-                    centrepoint_right_up = self.view.hexagon_centrepoints[device, row, column + 1]
-                    centrepoint_right_down = self.view.hexagon_centrepoints[device, row + 1, column + 1]
-                    centrepoint_down = self.view.hexagon_centrepoints[device, row + 1, column]
-
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_up, value_centre,
-                                                         value_right_up)
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_down,
-                                                         value_centre,
-                                                         value_right_down)
-                    self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_down, value_centre,
-                                                         value_down)
-                value_centre = self.formatted_data[device][column][column_len - 1]
-                value_right_up = self.formatted_data[device][column + 1][column_len - 1]
-                value_right_down = self.formatted_data[device][column + 1][column_len]
-
-                centrepoint_centre = self.view.hexagon_centrepoints[device, column_len - 1, column]
-                centrepoint_right_up = self.view.hexagon_centrepoints[device, column_len - 1, column + 1]
-                centrepoint_right_down = self.view.hexagon_centrepoints[device, column_len, column + 1]
-
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_up, value_centre,
-                                                     value_right_up)
-                self.evaluate_edge_and_create_marker(device, centrepoint_centre, centrepoint_right_down, value_centre,
-                                                     value_right_down)
-            else:
-                Exception("Unexpected hexagonal grid definition: adjacent columns of equal size")
-        return
-
-    def evaluate_edge_and_create_marker(self, device, centrepoint1, centrepoint2, value1, value2):
-        centrepoint1 = np.array(centrepoint1)
-        centrepoint2 = np.array(centrepoint2)
-        if min(value1, value2) <= self.darkness_threshold < max(value1, value2):
-            # indicates an edge between the two centrepoints
-            value_difference = value2 - value1
-            direction_vector = centrepoint2 - centrepoint1
-            distance = np.linalg.norm(direction_vector)
-            direction_vector /= distance
-            edge_marker_coords = centrepoint1 + direction_vector * distance * (
-                    self.darkness_threshold - value1) / value_difference
-            self.view.edge_marker_centrepoints[device].append(edge_marker_coords)
-            self.num_edge_markers += 1
-
-    def edge_fitting_function(self, xy, y0, angle):
-        x0 = self.view.edge_x0
-        p0 = np.array([x0, y0])
-        xy = np.array(xy)
-        v = [np.cos(angle * np.pi / 180), np.sin(angle * np.pi / 180)]  # vector defined by min_angle
-        distance_xy_v = abs(np.cross(v, xy - p0) / np.linalg.norm(v))
-        return distance_xy_v
+        summary = self.analysis_scheduler.summary()
+        for stats_device, stats in summary.items():
+            stats['stale_fits'] = self.stale_fits.get(stats_device, 0)
+            stats['skipped_fits'] = self.skipped_fits.get(stats_device, 0)
+            stats['cached_fits'] = self.cached_fits.get(stats_device, 0)
+        return summary[device] if device is not None else summary
 
+    @staticmethod
+    def cluster_thresholds(frames, min_contrast=80):
+        """
+        Splits every frame in a dark and a bright cluster at the largest jump between its sorted values
+        :param frames: (num_frames, num_cells) array
+        :param min_contrast: minimal difference between the means of both clusters for a frame to have a threshold
+        :return: (thresholds, means), the threshold halfway between the cluster means of each frame (-1 if the
+        clusters are too close) and the mean of each frame
+        """
+        data_sorted = np.sort(np.asarray(frames, dtype=np.int64), axis=1)
+        num_values = data_sorted.shape[1]
+        cutoff_idx = np.argmax(np.diff(data_sorted, axis=1), axis=1)
+        # Cluster sums are exact integers, so the means equal those of np.mean on each cluster
+        cumulative_sums = np.cumsum(data_sorted, axis=1)
+        dark_sums = np.take_along_axis(cumulative_sums, cutoff_idx[:, np.newaxis], axis=1)[:, 0]
+        cluster_dark_means = dark_sums / (cutoff_idx + 1)
+        cluster_bright_means = (cumulative_sums[:, -1] - dark_sums) / (num_values - cutoff_idx - 1)
+        thresholds = np.where(abs(cluster_dark_means - cluster_bright_means) < min_contrast, -1,
+                              (cluster_bright_means + cluster_dark_means) / 2)
+        return thresholds, cumulative_sums[:, -1] / num_values
+
+    @profiled('update_darkness_threshold')
+    def update_darkness_thresholds(self, devices, frames):
+        thresholds, means = self.cluster_thresholds(frames)
+        for device, threshold, mean in zip(devices, thresholds, means):
+            self.darkness_thresholds[device] = threshold
+            self.grid_values_means[device] = mean
+        return thresholds
+
+    @profiled('update_darkness_centrepoint')
+    def update_darkness_centrepoints(self, devices, device_indices, frames, thresholds):
+        dark = frames < thresholds[:, np.newaxis]
+        weights = np.where(dark, 255 - frames.astype(float), 0)  # values are uint8, which would overflow when summed
+        normalisations = weights.sum(axis=1)
+        centrepoints = np.einsum('dc,dck->dk', weights, self.cell_centrepoints[device_indices])
+        for device, threshold, normalisation, centrepoint in zip(devices, thresholds, normalisations, centrepoints):
+            if threshold == -1:
+                self.view.darkness_centrepoints[device] = None
+            elif normalisation:
+                self.view.darkness_centrepoints[device] = tuple(centrepoint / normalisation)
+
+    @profiled('update_edge_markers')
+    def update_edge_markers(self, devices, device_indices, frames, thresholds):
+        edge_marker_centrepoints = edge_marker_coords_batch(frames, thresholds,
+                                                            self.edge_pairs_first, self.edge_pairs_second,
+                                                            self.edge_pair_origins[device_indices],
+                                                            self.edge_pair_vectors[device_indices])
+        for device, centrepoints in zip(devices, edge_marker_centrepoints):
+            self.view.edge_marker_centrepoints[device] = centrepoints
+            self.num_edge_markers[device] = len(centrepoints)
+
+    def edge_fit_x0(self, device):
+        """
+        :return: x at which the straight edge fit of a device is evaluated, the centre of its tile
+        """
+        return self.view.layout.tile_centre_x(self.device_indices[device])
+
+    def corner_fit_bounds(self, device):
+        """
+        :return: ((x_min, y_min), (x_max, y_max)), the tile of a device, to which the corner point is clipped
+        """
+        return self.view.layout.tile_bounds(self.device_indices[device])
+
+    @profiled('update_edge_fit')
     def update_edge_fit(self, device):
         xy_array = np.array(self.view.edge_marker_centrepoints[device])
-        x0 = self.view.cell_width + self.view.tile_width / 2
-        self.view.edges_params[device] = (x0, 0, 0)
-        if xy_array.shape[0] < 2:
-            self.edge_fit_errors[device] = 0  # no edge so no error
-        else:
-            z_array = np.array([0 for _ in range(len(self.view.edge_marker_centrepoints[device]))])
-            guess = [self.view.cell_height + self.view.tile_height / 2, 0]
-            try:
-                optimisation_result = scipy_opt.curve_fit(self.edge_fitting_function, xdata=xy_array,
-                                                          ydata=z_array, p0=guess)
-                self.view.edges_params[device][1:] = optimisation_result[0]
-                perr = np.sqrt(np.diag(optimisation_result[1]))
-                self.edge_fit_errors[device] = np.mean(perr)
-                logger.debug(f'Edge fit error: {self.edge_fit_errors[device]}')
-            except RuntimeError:
-                self.view.edges_params[device] = (x0, 0, 0)
-                logger.error("Edge fit did not find a solution")
+        edge_fit = fit_edge(xy_array, self.edge_fit_x0(device))
+        self.publish_edge_fit(device, *edge_fit)
+        return edge_fit
+
+    def publish_edge_fit(self, device, edges_params, edge_fit_error):
+        self.view.edges_params[device] = edges_params
+        self.edge_fit_errors[device] = edge_fit_error
+        if edge_fit_error:
+            logger.debug(f'Edge fit error: {edge_fit_error}')
 
     @staticmethod
     def corner_fitting_function(xy, x0=30, y0=20, angle1=120, angle2=335):
@@ -264,70 +409,23 @@ class IRTouch32ViewModel:
         angle += (angle < 0) * 360
         return angle
 
+    @profiled('update_corner_fit')
     def update_corner_fit(self, device):
-        device_idx = self.devices.index(device)
-
-        self.view.corner_params[device] = (0, 0, 0, 0)
         xy_array = np.array(self.view.edge_marker_centrepoints[device])
-        if xy_array.shape[0] < 2:
-            pass
-        else:
-            z_array = np.array([0 for _ in range(len(self.view.edge_marker_centrepoints[device]))])
-            bounds = ([self.view.cell_width + device_idx * (self.view.cell_width + self.view.tile_width),
-                       self.view.cell_height, 0, 0],
-                      [self.view.cell_width + self.view.tile_width + device_idx * (
-                              self.view.cell_width + self.view.tile_width),
-                       self.view.cell_height + self.view.tile_height, 450, 450]
-                      )
-            educated_guess = np.array(self.prev_corner_fit[device])
-            init_guess_x0 = self.init_corner_fit[device][0]
-            init_guess_y0 = self.init_corner_fit[device][1]
-            guesses = [
-                educated_guess,
-                [init_guess_x0, init_guess_y0, 180, 270],
-                [init_guess_x0, init_guess_y0, 0, 90],
-                [init_guess_x0, init_guess_y0, 90, 180],
-                [init_guess_x0, init_guess_y0, 270, 360],
-            ]
-            error_prev = 9223372036854775807
-            for guess in guesses:
-                try:
-                    optimisation_result = scipy_opt.curve_fit(IRTouch32ViewModel.corner_fitting_function,
-                                                              xdata=xy_array,
-                                                              ydata=z_array,
-                                                              p0=guess,
-                                                              bounds=bounds)
-                    perr = np.sqrt(np.diag(optimisation_result[1]))
-                    error = np.mean(perr)
-                    if error < error_prev:
-                        parameters = optimisation_result[0]
-                        self.view.corner_params[device] = parameters
-                        angle = abs(parameters[3] - parameters[2])
-                        while angle > 180:
-                            angle -= 360
-                        self.corner_fit_angles[device] = abs(angle)
-                        error_prev = error
-                        self.prev_corner_fit[device] = list(self.view.corner_params[device])
-                        if error < 15:
-                            break
-                except RuntimeError:
-                    self.view.corner_params[device] = (0, 0, 0, 0)
-                    logger.error("Corner fit did not find a solution")
-            logger.debug(f'Corner fit error: {error_prev}')
+        corner_fit = fit_edge_corner(xy_array, self.corner_fit_bounds(device))
+        self.publish_corner_fit(device, *corner_fit)
+        return corner_fit
 
-    def calibrate_data(self, device):
-        data = self.current_data[device]
-        # self.calibrated_data[device] = 255 - np.rint(abs(np.array(self.calibration_data) - np.array(data))).astype(int)
-        self.calibrated_data[device] = np.rint(np.array(data) / np.array(self.calibration_data) * 255).astype(int)
-        self.calibrated_data[device][self.calibrated_data[device] > 255] = 255
+    def publish_corner_fit(self, device, corner_params, corner_angle, corner_fit_error):
+        self.view.corner_params[device] = corner_params
+        if corner_angle is not None:
+            self.corner_fit_angles[device] = corner_angle
+            logger.debug(f'Corner fit error: {corner_fit_error}')
 
-    def format_data(self, device):
+    @profiled('calibrate_data')
+    def calibrate_data(self, device):
         """
-        Data is a list of 32 values, with the list index of a value corresponding to the grid index as defined in the
-        __init__ of HexGridPlot.
+        Data is a flat frame of 32 values, the index of a value is the cell index as defined in the __init__ of
+        HexGridPlot, i.e. value i belongs to the cell at (view.cell_rows[i], view.cell_columns[i]).
         """
-        ctr = 0
-        for column, column_len in enumerate(self.grid_size):
-            for row in range(column_len):
-                self.formatted_data[device][column][row] = self.calibrated_data[device][ctr]
-                ctr += 1
+        self.calibrated_data[device] = self.calibration.apply(device, self.current_data[device])
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The package is imported as sensor_comm, from code/python, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
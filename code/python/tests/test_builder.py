@@ -0,0 +1,58 @@
+import asyncio
+import glob
+import os
+
+import pytest
+
+from sensor_comm.utils.builder import Builder
+from sensor_comm.utils.recording import load_recording
+
+DEVICES = ["00:00:00:00:00:01", "00:00:00:00:00:02"]
+NUM_PACKETS = 50
+
+
+def test_irtouch32_sim_headless(tmp_path):
+    """
+    Runs the whole IRTouch32 pipeline on simulated devices, without Bluetooth or a display
+    """
+    group = Builder.irtouch32(DEVICES, data_directory=str(tmp_path), comm_mode="SIM", view_mode="HEADLESS",
+                              storage_mode="BINARY", comm_options={"rate": None, "num_packets": NUM_PACKETS})
+    analysed = []
+    group.add_analysis_listener(analysed.append)
+
+    async def run():
+        subscription = asyncio.create_task(group.subscribe_to_devices())
+        while len(group.comm_handler.streams) < len(DEVICES):  # connecting and subscribing
+            await asyncio.sleep(0.01)
+        await group.comm_handler.wait_until_done()
+        subscription.cancel()
+        await asyncio.gather(subscription, return_exceptions=True)
+        await group.comm_handler.disconnect_devices()
+
+    try:
+        asyncio.run(run())
+    finally:
+        group.viewmodel.close()
+        group.data_handler.close()
+
+    assert set(analysed) == set(DEVICES)
+    for device in DEVICES:
+        assert group.get_frame_stats(device)['frames'] == NUM_PACKETS
+        timestamps, frames = group.get_history(device)
+        assert frames.shape == (NUM_PACKETS, 32)
+        results = group.get_current_results(device)
+        assert len(results['edge_params']) == 3 and len(results['corner_params']) == 4
+    records, recorded_devices = load_recording(glob.glob(os.path.join(str(tmp_path), '*.bin'))[0])
+    assert len(records) == NUM_PACKETS * len(DEVICES)
+    assert sorted(recorded_devices) == sorted(DEVICES)
+
+
+def test_capture_calibration_needs_history(tmp_path):
+    group = Builder.irtouch32(DEVICES, data_directory=str(tmp_path), comm_mode="SIM", view_mode="HEADLESS",
+                              history_capacity=0)
+    try:
+        with pytest.raises(ValueError, match="history"):
+            asyncio.run(group.capture_calibration(duration=0))
+    finally:
+        group.viewmodel.close()
+        group.data_handler.close()
@@ -0,0 +1,19 @@
+import numpy as np
+
+from sensor_comm.utils.codecs import UINT8_INVERTED, UINT16_LE
+
+
+def test_uint8_inverted_round_trip():
+    data = np.arange(32, dtype=np.uint8)
+    packet = bytearray(UINT8_INVERTED.encode(data))
+    assert list(packet) == [255 - value for value in range(32)]
+    np.testing.assert_array_equal(UINT8_INVERTED.decode(packet), data)
+
+
+def test_decode_batch_matches_decode():
+    frames = np.random.default_rng(0).integers(0, 2 ** 16, (10, 25)).astype(np.uint16)
+    packets = [bytearray(UINT16_LE.encode(frame)) for frame in frames]
+    batch = UINT16_LE.decode_batch(packets)
+    np.testing.assert_array_equal(batch, frames)
+    np.testing.assert_array_equal(batch, [UINT16_LE.decode(packet) for packet in packets])
+    assert UINT16_LE.decode_batch([]).shape == (0, 0)
@@ -0,0 +1,41 @@
+import time
+
+import numpy as np
+
+from sensor_comm.utils.data_handler import IRTouchDataHandler
+from sensor_comm.utils.data_writer import DataWriter, FlushPolicy
+
+DEVICES = ["00:00:00:00:00:01"]
+
+
+def test_writer_survives_failing_batch():
+    written = []
+
+    def write(batch):
+        if batch[0] is None:
+            raise TypeError("can't format this frame")
+        written.extend(batch)
+
+    writer = DataWriter(write)
+    writer.submit([None, 1])
+    writer.submit([2, 3, 4])
+    writer.close(timeout=5)
+    assert written == [2, 3, 4]
+    assert writer.dropped_frames == 2 and writer.written_frames == 3
+
+
+def test_stalled_stream_is_flushed(tmp_path):
+    """
+    Frames that arrive just before the stream stalls are written after max_interval, not only at close
+    """
+    data_handler = IRTouchDataHandler(DEVICES, directory=str(tmp_path), grid_size=(5, 4, 5, 4, 5, 4, 5),
+                                      storage_mode="BINARY", flush_policy=FlushPolicy(max_frames=100, max_interval=0.05))
+    try:
+        for _ in range(3):
+            data_handler.persist(np.zeros(32, dtype=np.uint8), DEVICES[0])
+        deadline = time.monotonic() + 5
+        while data_handler.writer.written_frames < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert data_handler.writer.written_frames == 3
+    finally:
+        data_handler.close()
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+CODE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEVICES = ["00:00:00:00:00:01", "00:00:00:00:00:02"]
+
+
+def test_view_process_imports(tmp_path):
+    """
+    The view process is spawned, i.e. it imports its entry point in a fresh interpreter, with only the package on the
+    path
+    """
+    result = subprocess.run([sys.executable, '-c',
+                             'from sensor_comm.visualisation.view.process_view import run_view_process\n'
+                             'from sensor_comm.visualisation.view.irtouch32_view import IRTouch32View'],
+                            cwd=tmp_path, env={**os.environ, 'PYTHONPATH': CODE_DIRECTORY},
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.mark.skipif(not os.environ.get('DISPLAY'), reason="the view process needs a display")
+def test_view_process_runs():
+    from sensor_comm.visualisation.view.process_view import ProcessIRTouch32View
+
+    view = ProcessIRTouch32View(devices=DEVICES)
+    try:
+        for _ in range(20):
+            view.update_view()
+            time.sleep(0.05)
+        assert view.process.is_alive()
+        assert not view.process_lost
+    finally:
+        view.close()
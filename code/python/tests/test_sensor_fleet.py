@@ -0,0 +1,54 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from sensor_comm.utils.builder import Builder
+from sensor_comm.utils.hex_grid import HexGridLayout
+
+DEVICES = [f"00:00:00:00:00:{device_idx:02X}" for device_idx in range(5)]
+GRID_SIZE = (5, 4, 5, 4, 5, 4, 5)
+
+
+def test_irtouch32_fleet_sim(tmp_path):
+    """
+    Runs a fleet of two worker processes on simulated devices and checks that it answers like an IRTouchGroup of all
+    devices would
+    """
+    fleet = Builder.irtouch32_fleet(DEVICES, num_workers=2, grid_size=GRID_SIZE, data_directory=str(tmp_path),
+                                    comm_mode="SIM", storage_mode="BINARY", comm_options={"rate": 200})
+    listener_threads = set()
+    fleet.add_analysis_listener(lambda device: listener_threads.add(threading.current_thread()))
+    calibration_path = os.path.join(str(tmp_path), 'calibration.json')
+
+    async def run():
+        subscription = asyncio.create_task(fleet.subscribe_to_devices())
+        try:
+            deadline = time.monotonic() + 60  # spawning the workers takes a while
+            while any(fleet.get_current_results(device) is None for device in DEVICES):
+                assert time.monotonic() < deadline, "not every device reported results"
+                assert not subscription.done(), "the workers stopped"
+                await asyncio.sleep(0.1)
+            await fleet.capture_calibration(duration=0.2, path=calibration_path)
+        finally:
+            fleet.close()
+            await subscription
+
+    asyncio.run(run())
+
+    assert listener_threads == {threading.main_thread()}
+    layout = HexGridLayout(GRID_SIZE, len(DEVICES))
+    for device_idx, device in enumerate(DEVICES):
+        (x_min, y_min), (x_max, y_max) = layout.tile_bounds(device_idx)
+        x0, y0, _ = fleet.get_current_edge_params(device)
+        assert x_min <= x0 <= x_max
+        darkness_centrepoint = fleet.get_current_results(device)['darkness_centrepoint']
+        if darkness_centrepoint is not None:
+            assert x_min <= darkness_centrepoint[0] <= x_max and y_min <= darkness_centrepoint[1] <= y_max
+        timestamps, frames = fleet.get_history(device)
+        assert len(timestamps) and frames.shape[1] == sum(GRID_SIZE)
+        assert set(fleet.get_analysis_stats(device)) >= {'processed', 'coalesced', 'dropped'}
+        assert fleet.get_frame_stats(device)['frames'] > 0
+    with open(calibration_path) as calibration_file:
+        assert sorted(json.load(calibration_file)) == sorted(DEVICES)